@@ -0,0 +1,270 @@
+from bisect import bisect_right
+import json
+import os
+import struct
+from State import StateTable
+
+
+# Dimensions of every image of a storyboard, read from the file headers only. Sizes are remembered by path together
+# with the size and modification time of the file and can be kept on disk, so only new or changed images are read
+class ImageIndex:
+    extensions = ('.png', '.jpg', '.jpeg')
+
+    def __init__(self, song_folder, sb_folder='', cache_path=None):
+        """
+        :param song_folder: folder sprite paths are relative to
+        :param sb_folder: folder below it holding the images, everything in it is indexed
+        :param cache_path: optional JSON file the dimensions are kept in between runs
+        """
+        self.song_folder = song_folder
+        self.sb_folder = sb_folder
+        self.cache_path = cache_path
+        self.sizes = dict()         # normalized relative path -> (width, height)
+        self.cache = dict()         # normalized relative path -> [size, mtime, width, height]
+        self.reads = 0              # headers actually read, everything else came from the cache
+
+        if cache_path is not None and os.path.exists(cache_path):
+            with open(cache_path, encoding='utf8') as file:
+                self.cache = json.load(file)
+        self.index()
+
+    @classmethod
+    def normalize(cls, path) -> str:
+        # osu! is used on case insensitive file systems and storyboards mix up both kinds of slashes
+        return path.replace('\\', '/').strip('/').lower()
+
+    @classmethod
+    def png_size(cls, file):
+        # width and height are the first two fields of the IHDR chunk right after the signature
+        header = file.read(24)
+        if len(header) < 24 or header[:8] != b'\x89PNG\r\n\x1a\n':
+            return None
+        return struct.unpack('>II', header[16:24])
+
+    @classmethod
+    def jpeg_size(cls, file):
+        # walks the segments up to the first start of frame, skipping everything else by its length
+        if file.read(2) != b'\xff\xd8':
+            return None
+        while True:
+            marker = file.read(2)
+            if len(marker) < 2 or marker[0] != 0xff:
+                return None
+            code = marker[1]
+            if code == 0xff:
+                file.seek(-1, 1)
+                continue
+            if code in (0x01, 0xd8) or 0xd0 <= code <= 0xd7:
+                continue
+            length = file.read(2)
+            if len(length) < 2:
+                return None
+            (length,) = struct.unpack('>H', length)
+            if 0xc0 <= code <= 0xcf and code not in (0xc4, 0xc8, 0xcc):
+                frame = file.read(5)
+                if len(frame) < 5:
+                    return None
+                height, width = struct.unpack('>HH', frame[1:5])
+                return width, height
+            file.seek(length - 2, 1)
+
+    @classmethod
+    def read_size(cls, path):
+        """
+        :param path: image file
+        :return: (width, height) or None if the file isn't a png or jpeg it understands
+        """
+        with open(path, 'rb') as file:
+            start = file.read(2)
+            file.seek(0)
+            if start == b'\xff\xd8':
+                return ImageIndex.jpeg_size(file)
+            return ImageIndex.png_size(file)
+
+    def index(self):
+        # reads the headers of new and changed images, everything else comes out of the cache
+        root = os.path.join(self.song_folder, self.sb_folder)
+        cache = dict()
+        for folder, _, files in os.walk(root):
+            for name in files:
+                if not name.lower().endswith(ImageIndex.extensions):
+                    continue
+                path = os.path.join(folder, name)
+                key = ImageIndex.normalize(os.path.relpath(path, self.song_folder))
+                stat = os.stat(path)
+                entry = self.cache.get(key)
+                if entry is None or entry[0] != stat.st_size or entry[1] != stat.st_mtime_ns:
+                    size = ImageIndex.read_size(path)
+                    self.reads += 1
+                    if size is None:
+                        continue
+                    entry = [stat.st_size, stat.st_mtime_ns, size[0], size[1]]
+                cache[key] = entry
+                self.sizes[key] = (entry[2], entry[3])
+        self.cache = cache
+
+        if self.cache_path is not None:
+            with open(self.cache_path, 'w', encoding='utf8') as file:
+                json.dump(self.cache, file)
+
+    def size(self, sbobj):
+        """
+        :param sbobj: sprite or animation
+        :return: (width, height) of its image or None if it isn't indexed, animations use their first frame
+        """
+        path = sbobj.path
+        if sbobj.t == 'Animation':
+            base, extension = os.path.splitext(path)
+            path = '{}0{}'.format(base, extension)
+        return self.sizes.get(ImageIndex.normalize(path))
+
+
+# Estimates where a storyboard gets expensive for the client: how many sprites are alive and how many pixels they
+# cover at every moment, found with a single sweep over the starts and ends of every sprite's life
+class Analyzer:
+    # pixels of the widescreen storyboard area, an overdraw of 1 means the screen is covered once
+    screen = 854 * 480
+
+    def __init__(self, sprites, images=None):
+        """
+        :param sprites: iterable of sprites in render order
+        :param images: ImageIndex for the image sizes, without one every sprite counts as a single screen pixel
+        """
+        self.paths = list()
+        self.layers = list()
+        self.borns = list()
+        self.dies = list()
+        self.areas = list()         # largest amount of pixels a sprite covers at once
+        self.missing = set()        # image paths sprites use that aren't in the index
+
+        for sbobj in sprites:
+            commands = StateTable.commands(sbobj)
+            if not commands:
+                continue
+            size = images.size(sbobj) if images is not None else (1, 1)
+            if size is None:
+                self.missing.add(sbobj.path)
+                size = (1, 1)
+            scale = Analyzer.largest(commands)
+
+            self.paths.append(sbobj.path)
+            self.layers.append(sbobj.layer)
+            self.borns.append(min(command.start_time for command in commands))
+            self.dies.append(max(command.end_time for command in commands))
+            self.areas.append(size[0] * size[1] * scale[0] * scale[1])
+
+        self.timeline = self.sweep()
+
+    @classmethod
+    def largest(cls, commands) -> tuple:
+        """
+        :param commands: plain commands of a sprite
+        :return: tuple of the largest horizontal and vertical scale the commands reach at one of their ends, scale
+        and vector multiply and either is 1 when nothing sets it
+        """
+        scale = 1.0
+        vector = [1.0, 1.0]
+        scaled = False
+        stretched = False
+        for command in commands:
+            if command.t == 'S':
+                start, end = command.params()
+                value = max(abs(float(start[0])), abs(float(end[0])))
+                scale = max(scale, value) if scaled else value
+                scaled = True
+            elif command.t == 'V':
+                start, end = command.params()
+                values = [max(abs(float(a)), abs(float(b))) for a, b in zip(start, end)]
+                vector = [max(old, new) for old, new in zip(vector, values)] if stretched else values
+                stretched = True
+        return scale * vector[0], scale * vector[1]
+
+    def sweep(self) -> list:
+        """
+        :return: list of (time, active sprites, pixels) from that time on until the next entry
+        """
+        events = [(born, 1, area) for born, area in zip(self.borns, self.areas)]
+        # sprites are still there at the moment their last command ends
+        events += [(dies, -1, -area) for dies, area in zip(self.dies, self.areas)]
+        events.sort(key=lambda event: (event[0], -event[1]))
+
+        timeline = list()
+        active = 0
+        pixels = 0.0
+        i = 0
+        while i < len(events):
+            time = events[i][0]
+            # everything starting at a time counts before anything that ends at it is taken off
+            peak_active, peak_pixels = active, pixels
+            while i < len(events) and events[i][0] == time:
+                active += events[i][1]
+                pixels += events[i][2]
+                peak_active = max(peak_active, active)
+                peak_pixels = max(peak_pixels, pixels)
+                i += 1
+            timeline.append((time, peak_active, peak_pixels))
+            if (active, pixels) != (peak_active, peak_pixels):
+                timeline.append((time + 1, active, max(pixels, 0.0)))
+        return timeline
+
+    def alive_at(self, time) -> list:
+        # indices of every sprite alive at time
+        return [i for i in range(len(self.borns)) if self.borns[i] <= time <= self.dies[i]]
+
+    def at(self, time):
+        """
+        :return: tuple of active sprites and pixels at time
+        """
+        i = bisect_right(self.timeline, (time, float('inf'), float('inf'))) - 1
+        if i < 0:
+            return 0, 0.0
+        return self.timeline[i][1], self.timeline[i][2]
+
+    def peaks(self, metric='pixels', count=5, width=1000, responsible=10):
+        """
+        finds the most expensive stretches of the storyboard
+        :param metric: 'pixels' or 'active'
+        :param count: amount of windows to report
+        :param width: length of the windows in ms, the storyboard is cut into windows of this length
+        :param responsible: amount of sprites to name per window, the ones covering the most pixels first
+        :return: list of dictionaries with start, end, the peak of both metrics inside the window, the time of the
+        peak and the sprites alive at it
+        """
+        column = 2 if metric == 'pixels' else 1
+        windows = dict()        # window index -> (time, active, pixels) entry with the highest metric in it
+        previous = None
+        for entry in self.timeline:
+            window = int(entry[0] // width)
+            if window not in windows and previous is not None:
+                # whatever was alive before the window started is still there at its start
+                windows[window] = (window * width, previous[1], previous[2])
+            previous = entry
+            best = windows.get(window)
+            if best is None or entry[column] > best[column]:
+                windows[window] = entry
+
+        report = list()
+        for window, (time, active, pixels) in sorted(windows.items(), key=lambda item: -item[1][column])[:count]:
+            alive = sorted(self.alive_at(time), key=lambda i: -self.areas[i])
+            report.append({'start': window * width,
+                           'end': (window + 1) * width,
+                           'time': time,
+                           'active': active,
+                           'pixels': pixels,
+                           'overdraw': pixels / Analyzer.screen,
+                           'sprites': [{'path': self.paths[i], 'layer': self.layers[i], 'born': self.borns[i],
+                                        'dies': self.dies[i], 'pixels': self.areas[i]} for i in alive[:responsible]]})
+        return report
+
+    def report(self, count=5, width=1000, responsible=10) -> dict:
+        """
+        :return: dictionary with the overall peaks, the most expensive windows by pixels and by active sprites and
+        the images that couldn't be found
+        """
+        return {'sprites': len(self.paths),
+                'peak_active': max((entry[1] for entry in self.timeline), default=0),
+                'peak_pixels': max((entry[2] for entry in self.timeline), default=0.0),
+                'peak_overdraw': max((entry[2] for entry in self.timeline), default=0.0) / Analyzer.screen,
+                'windows_by_pixels': self.peaks('pixels', count, width, responsible),
+                'windows_by_active': self.peaks('active', count, width, responsible),
+                'missing_images': sorted(self.missing)}
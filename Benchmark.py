@@ -0,0 +1,413 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from math import cos, pi, sin, sqrt
+from Command import CommandPool, CommandTable, F, M
+from Storyboard import Storyboard
+import Easing
+
+# command type -> relative weight, how often each type shows up in synthetic storyboards by default
+default_mix = {'F': 3, 'M': 2, 'MX': 1, 'MY': 1, 'S': 2, 'V': 1, 'R': 1, 'C': 1}
+
+# file name of the difficulty synthetic_beatmap writes
+beatmap_name = 'Benchmark - Synthetic (osu-sbgen) [Bench].osu'
+
+
+def measure(build):
+    """
+    measures the memory a structure holds after it's built
+    :param build: function building the structure
+    :return: tuple of the structure and the bytes still allocated by it
+    """
+    tracemalloc.start()
+    result = build()
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, allocated
+
+
+def command_memory(count=100000, distinct=100, seed=0):
+    """
+    bytes per command for the different ways of holding commands, half fades shared between particles and half
+    unique moves
+    :param count: commands to build
+    :param distinct: amount of different fades the shared half is picked from
+    :param seed: random seed for the generated times
+    :return: dictionary of layout name -> bytes per command
+    """
+    rng = random.Random(seed)
+    fades = [rng.randrange(0, 100000) for _ in range(distinct)]
+    rows = list()
+    for i in range(count):
+        if i % 2:
+            start = rng.choice(fades)
+            rows.append(('F', (0, start, start + 500, 0, 1)))
+        else:
+            start = rng.randrange(0, 100000)
+            rows.append(('M', (0, start, start + 500, 320, 240, rng.randrange(640), rng.randrange(480))))
+    classes = {'F': F, 'M': M}
+
+    # how commands were laid out before they got slots: a plain object with an instance dictionary
+    class Unslotted:
+        pass
+
+    def unslotted():
+        commands = list()
+        for t, args in rows:
+            command = classes[t](*args)
+            plain = Unslotted()
+            for cls in type(command).__mro__:
+                for name in getattr(cls, '__slots__', ()):
+                    setattr(plain, name, getattr(command, name))
+            commands.append(plain)
+        return commands
+
+    def slotted():
+        return [classes[t](*args) for t, args in rows]
+
+    def interned():
+        pool = CommandPool()
+        return pool, [pool.intern(classes[t](*args)) for t, args in rows]
+
+    # the pool is only needed while generating, afterwards only the shared instances are left
+    def interned_released():
+        return interned()[1]
+
+    def table():
+        commands = CommandTable()
+        for t, args in rows:
+            commands.append(classes[t](*args))
+        return commands
+
+    results = dict()
+    for name, build in (('dict', unslotted), ('slots', slotted), ('slots+pool', interned),
+                        ('slots interned', interned_released), ('table', table)):
+        _, allocated = measure(build)
+        results[name] = allocated / count
+    return results
+
+
+def naive_bounce(t):
+    # out bounce written out on its own, with the segment offsets spelled out
+    if t < 1 / 2.75:
+        return 7.5625 * t * t
+    if t < 2 / 2.75:
+        return 7.5625 * (t - 1.5 / 2.75) ** 2 + .75
+    if t < 2.5 / 2.75:
+        return 7.5625 * (t - 2.25 / 2.75) ** 2 + .9375
+    return 7.5625 * (t - 2.625 / 2.75) ** 2 + .984375
+
+
+def naive_ease(easing, t):
+    # straightforward per sample implementation that walks the ids on every call, what ease_many is measured against.
+    # It shares no code with the Easing module, so both have to agree on their own
+    if easing == 0:
+        return t
+    elif easing == 1 or easing == 4:
+        return t * (2 - t)
+    elif easing == 2 or easing == 3:
+        return t * t
+    elif easing == 5:
+        return 2 * t * t if t < .5 else 1 - 2 * (t - 1) ** 2
+    elif easing == 6:
+        return t ** 3
+    elif easing == 7:
+        return (t - 1) ** 3 + 1
+    elif easing == 8:
+        return 4 * t ** 3 if t < .5 else 4 * (t - 1) ** 3 + 1
+    elif easing == 9:
+        return t ** 4
+    elif easing == 10:
+        return 1 - (t - 1) ** 4
+    elif easing == 11:
+        return 8 * t ** 4 if t < .5 else 1 - 8 * (t - 1) ** 4
+    elif easing == 12:
+        return t ** 5
+    elif easing == 13:
+        return (t - 1) ** 5 + 1
+    elif easing == 14:
+        return 16 * t ** 5 if t < .5 else 16 * (t - 1) ** 5 + 1
+    elif easing == 15:
+        return 1 - cos(t * pi / 2)
+    elif easing == 16:
+        return sin(t * pi / 2)
+    elif easing == 17:
+        return .5 - .5 * cos(pi * t)
+    elif easing == 18:
+        return 2 ** (10 * (t - 1))
+    elif easing == 19:
+        return 1 - 2 ** (-10 * t)
+    elif easing == 20:
+        return .5 * 2 ** (20 * t - 10) if t < .5 else 1 - .5 * 2 ** (10 - 20 * t)
+    elif easing == 21:
+        return 1 - sqrt(1 - t * t)
+    elif easing == 22:
+        return sqrt(1 - (t - 1) ** 2)
+    elif easing == 23:
+        return .5 - .5 * sqrt(1 - 4 * t * t) if t < .5 else .5 + .5 * sqrt(1 - (2 * t - 2) ** 2)
+    elif easing == 24:
+        return -2 ** (10 * t - 10) * sin((1 - .075 - t) * 20 * pi / 3)
+    elif easing == 25:
+        return 2 ** (-10 * t) * sin((t - .075) * 20 * pi / 3) + 1
+    elif easing == 26:
+        return 2 ** (-10 * t) * sin((t / 2 - .075) * 20 * pi / 3) + 1
+    elif easing == 27:
+        return 2 ** (-10 * t) * sin((t / 4 - .075) * 20 * pi / 3) + 1
+    elif easing == 28:
+        if t < .5:
+            return -.5 * 2 ** (20 * t - 10) * sin((1 - .1125 - 2 * t) * 40 * pi / 9)
+        return .5 * 2 ** (10 - 20 * t) * sin((2 * t - 1 - .1125) * 40 * pi / 9) + 1
+    elif easing == 29:
+        return t * t * (2.70158 * t - 1.70158)
+    elif easing == 30:
+        return (t - 1) ** 2 * (2.70158 * (t - 1) + 1.70158) + 1
+    elif easing == 31:
+        if t < .5:
+            return 2 * t * t * (3.5949095 * 2 * t - 2.5949095)
+        return .5 * ((2 * t - 2) ** 2 * (3.5949095 * (2 * t - 2) + 2.5949095) + 2)
+    elif easing == 32:
+        return 1 - naive_bounce(1 - t)
+    elif easing == 33:
+        return naive_bounce(t)
+    elif easing == 34:
+        return .5 - .5 * naive_bounce(1 - 2 * t) if t < .5 else .5 + .5 * naive_bounce(2 * t - 1)
+    return t
+
+
+def easing_speed(samples=100000):
+    """
+    samples per second of Easing.ease_many against evaluating every sample on its own with naive_ease. ease_many
+    maps the scalar function of the id over the samples, all it saves is walking the ids for every sample. That
+    pays off most for ids far down the chain, for some of the cheap early ids the extra function call makes it
+    slower
+    :param samples: samples per easing
+    :return: dictionary of easing id -> (naive samples per second, ease_many samples per second)
+    """
+    progress = [i / (samples - 1) for i in range(samples)]
+    results = dict()
+    for easing in sorted(Easing.functions):
+        start = time.perf_counter()
+        naive = [naive_ease(easing, t) for t in progress]
+        naive_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        eased = Easing.ease_many(easing, progress)
+        many_time = time.perf_counter() - start
+
+        # both have to agree or the comparison means nothing
+        if any(abs(a - b) > 1e-9 for a, b in zip(naive, eased)):
+            raise ValueError('naive and vectorized easing differ', easing)
+        results[easing] = (samples / naive_time, samples / many_time)
+    return results
+
+
+def synthetic_beatmap(folder, timing_points=200, hit_objects=2000, seed=0):
+    """
+    writes a made up difficulty to parse storyboards against
+    :param folder: folder to write the .osu into
+    :param timing_points: amount of uninherited timing points, every other one is followed by an inherited one
+    :param hit_objects: amount of circles
+    :param seed: random seed for bpm changes and object positions
+    :return: file name of the .osu
+    """
+    rng = random.Random(seed)
+    name = beatmap_name
+    lines = ['osu file format v14', '', '[General]', 'AudioFilename: audio.mp3', '', '[Metadata]',
+             'Title:Synthetic', 'Artist:Benchmark', 'Creator:osu-sbgen', 'Version:Bench', '', '[TimingPoints]']
+    offset = 0
+    for i in range(timing_points):
+        beat_length = 60000 / rng.randrange(90, 240)
+        lines.append('{},{},4,2,0,60,1,0'.format(offset, beat_length))
+        if i % 2:
+            lines.append('{},-{},4,2,0,60,0,{}'.format(offset + int(beat_length), rng.randrange(50, 200), i % 4 // 2))
+        offset += int(beat_length * 16)
+    lines += ['', '', '[Colours]', 'Combo1 : 255,0,0', '', '[HitObjects]']
+    for i in range(hit_objects):
+        lines.append('{},{},{},1,0,0:0:0:0:'.format(rng.randrange(512), rng.randrange(384),
+                                                    i * offset // max(hit_objects, 1)))
+
+    with open(os.path.join(folder, name), 'w', encoding='utf8') as file:
+        file.write('\n'.join(lines) + '\n')
+    return name
+
+
+def synthetic_storyboard(folder, sprites=1000, commands=20, mix=None, seed=0):
+    """
+    builds a storyboard of random sprites through Factory.build, the way generator scripts build them
+    :param folder: folder holding the .osu synthetic_beatmap wrote
+    :param sprites: amount of sprites
+    :param commands: commands per sprite
+    :param mix: dictionary of command type -> relative weight, defaults to default_mix
+    :param seed: random seed, the same seed always builds the same storyboard
+    :return: tuple of the storyboard and the seconds spent in Factory.build
+    """
+    rng = random.Random(seed)
+    mix = mix or default_mix
+    types = list(mix)
+    weights = [mix[t] for t in types]
+    values = {'F': lambda: (rng.random(),),
+              'M': lambda: (rng.randrange(-107, 747), rng.randrange(480)),
+              'MX': lambda: (rng.randrange(-107, 747),),
+              'MY': lambda: (rng.randrange(480),),
+              'S': lambda: (rng.uniform(.1, 2),),
+              'V': lambda: (rng.uniform(.1, 2), rng.uniform(.1, 2)),
+              'R': lambda: (rng.uniform(-3.14, 3.14),),
+              'C': lambda: (rng.randrange(256), rng.randrange(256), rng.randrange(256))}
+
+    storyboard = Storyboard(folder, synthetic_beatmap(folder, seed=seed))
+    factory = storyboard.new_command_factory()
+    building = 0.0
+    for i in range(sprites):
+        sprite = storyboard.new_sprite('sb/particle{}.png'.format(i % 16))
+        for t in rng.choices(types, weights, k=commands):
+            start = rng.randrange(0, 300000)
+            factory.type(t).start(start).end(start + rng.randrange(0, 2000))
+            factory.easing(rng.randrange(35))
+            factory.tupS = values[t]()
+            factory.tupE = values[t]()
+
+            clock = time.perf_counter()
+            command = factory.build()
+            building += time.perf_counter() - clock
+            sprite.append(command)
+    return storyboard, building
+
+
+def timed(function, repeat=3):
+    # best wall time out of a few runs, the least disturbed one is the closest to what the code costs
+    best = None
+    for _ in range(repeat):
+        clock = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - clock
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def peak_memory(function):
+    # highest amount of memory allocated at once while the function runs
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def suite(sprites=1000, commands=20, mix=None, seed=0, repeat=3):
+    """
+    times building, rendering, writing and parsing a synthetic storyboard and records the peak memory of each
+    :param sprites: amount of sprites
+    :param commands: commands per sprite
+    :param mix: dictionary of command type -> relative weight, defaults to default_mix
+    :param seed: random seed
+    :param repeat: runs per benchmark, the best time is kept
+    :return: dictionary with the configuration and benchmark name -> {'seconds': ..., 'peak_bytes': ...}
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        builds = [synthetic_storyboard(folder, sprites, commands, mix, seed)[1] for _ in range(repeat)]
+        storyboard = synthetic_storyboard(folder, sprites, commands, mix, seed)[0]
+        build_peak = peak_memory(lambda: synthetic_storyboard(folder, sprites, commands, mix, seed))
+
+        benchmarks = {'sprite_render': lambda: [sprite.render() for sprite in storyboard.sprites],
+                      'storyboard_render': storyboard.render,
+                      'to_osb': storyboard.to_osb,
+                      'parse_osu_difficulty': lambda: storyboard.parse_osu_difficulty(beatmap_name)}
+
+        results = {'factory_build': {'seconds': min(builds), 'peak_bytes': build_peak}}
+        for name, function in benchmarks.items():
+            results[name] = {'seconds': timed(function, repeat), 'peak_bytes': peak_memory(function)}
+
+    return {'config': {'sprites': sprites, 'commands': commands, 'mix': mix or default_mix, 'seed': seed,
+                       'repeat': repeat},
+            'python': platform.python_version(),
+            'results': results}
+
+
+def compare(current, baseline, threshold=.1):
+    """
+    finds benchmarks that got slower or hungrier than a stored run
+    :param current: result of suite
+    :param baseline: stored result of suite
+    :param threshold: relative increase that counts as a regression, .1 is 10%
+    :return: list of dictionaries describing each regression, empty if there are none
+    """
+    if current['config'] != baseline['config']:
+        print('warning: the baseline was recorded with a different configuration', file=sys.stderr)
+
+    regressions = list()
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        for metric in ('seconds', 'peak_bytes'):
+            if before[metric] and result[metric] > before[metric] * (1 + threshold):
+                regressions.append({'benchmark': name, 'metric': metric, 'baseline': before[metric],
+                                    'current': result[metric], 'change': result[metric] / before[metric] - 1})
+    return regressions
+
+
+def parse_mix(text):
+    # "F=3,M=2" -> {'F': 3, 'M': 2}
+    mix = dict()
+    for entry in text.split(','):
+        t, _, weight = entry.partition('=')
+        mix[t.strip()] = float(weight) if weight else 1.0
+    return mix
+
+
+def print_results(results):
+    width = max(len(name) for name in results)
+    for name, value in results.items():
+        print('{} {:>12.1f}'.format(name.ljust(width), value))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='osu-sbgen benchmarks')
+    parser.add_argument('benchmark', choices=['memory', 'easing', 'suite'])
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--sprites', type=int, default=1000, help='suite: amount of sprites')
+    parser.add_argument('--commands', type=int, default=20, help='suite: commands per sprite')
+    parser.add_argument('--mix', type=parse_mix, default=None, help='suite: command type weights, e.g. F=3,M=2')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='suite: runs per benchmark, the best is kept')
+    parser.add_argument('--json', help='suite: file to write the results to')
+    parser.add_argument('--baseline', help='suite: results to compare against, exits with 1 on regressions')
+    parser.add_argument('--threshold', type=float, default=.1, help='suite: relative slowdown that is flagged')
+    arguments = parser.parse_args()
+
+    if arguments.benchmark == 'memory':
+        print('bytes per command')
+        print_results(command_memory(arguments.count))
+    elif arguments.benchmark == 'easing':
+        print('easing  naive samples/s  ease_many samples/s  speedup')
+        speedups = dict()
+        for easing, (naive, many) in easing_speed(arguments.count).items():
+            speedups[easing] = many / naive
+            print('{:>6} {:>16.0f} {:>20.0f} {:>8.2f}x'.format(easing, naive, many, many / naive))
+        mean = 1.0
+        for speedup in speedups.values():
+            mean *= speedup
+        print('geometric mean speedup {:.2f}x, ease_many is slower for ids {}'.format(
+            mean ** (1 / len(speedups)), [easing for easing, speedup in speedups.items() if speedup < 1] or 'none'))
+    elif arguments.benchmark == 'suite':
+        results = suite(arguments.sprites, arguments.commands, arguments.mix, arguments.seed, arguments.repeat)
+        for name, result in results['results'].items():
+            print('{:<22} {:>10.4f}s {:>14} bytes peak'.format(name, result['seconds'], result['peak_bytes']))
+
+        if arguments.json:
+            with open(arguments.json, 'w', encoding='utf8') as file:
+                json.dump(results, file, indent=2)
+
+        if arguments.baseline:
+            with open(arguments.baseline, encoding='utf8') as file:
+                regressions = compare(results, json.load(file), arguments.threshold)
+            for regression in regressions:
+                print('REGRESSION {benchmark} {metric}: {baseline} -> {current} ({change:+.1%})'.format(**regression))
+            if regressions:
+                sys.exit(1)
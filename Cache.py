@@ -0,0 +1,152 @@
+from array import array
+import hashlib
+import json
+import os
+import struct
+import sys
+import tempfile
+import Parser
+
+
+# Keeps parsed beatmaps on disk so rebuilding storyboards against the same difficulties skips parsing entirely.
+# Entries are named after a key of the .osu (its content hash, or its path, size and modification time) and the format
+# version, so edited files and old formats simply miss. Hits refresh an entry's modification time, which is what the
+# least recently used ones are evicted by once the cache grows past its size limit
+class BeatmapCache:
+    version = 1                 # bump whenever the layout of Parser.Beatmap or the file format changes
+    magic = b'SBGB'
+    header = struct.Struct('<4sHB')     # magic, version, 1 if written on a little endian machine
+    column = struct.Struct('<cI')       # typecode, amount of items
+
+    def __init__(self, folder, max_bytes=64 << 20, key='hash'):
+        """
+        :param folder: directory holding the cache, created if it doesn't exist
+        :param max_bytes: size the cache is trimmed down to after every store
+        :param key: 'hash' keys entries by the content of the .osu, 'mtime' by its path, size and modification time,
+        which skips reading the file but trusts its timestamp
+        """
+        if key not in ('hash', 'mtime'):
+            raise ValueError('BeatmapCache key has to be hash or mtime', key)
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.key_type = key
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(folder, exist_ok=True)
+
+    def key(self, path) -> str:
+        digest = hashlib.sha1()
+        if self.key_type == 'hash':
+            with open(path, 'rb') as file:
+                for block in iter(lambda: file.read(1 << 20), b''):
+                    digest.update(block)
+        else:
+            stat = os.stat(path)
+            digest.update('{}|{}|{}'.format(os.path.abspath(path), stat.st_size, stat.st_mtime_ns).encode('utf8'))
+        return '{}-v{}'.format(digest.hexdigest(), BeatmapCache.version)
+
+    def entry(self, key) -> str:
+        return os.path.join(self.folder, key + '.bin')
+
+    @classmethod
+    def dumps(cls, beatmap) -> bytes:
+        parts = [BeatmapCache.header.pack(BeatmapCache.magic, BeatmapCache.version, sys.byteorder == 'little')]
+        metadata = json.dumps(beatmap.metadata).encode('utf8')
+        parts.append(struct.pack('<I', len(metadata)))
+        parts.append(metadata)
+        for name in Parser.Beatmap.columns:
+            column = getattr(beatmap, name)
+            parts.append(BeatmapCache.column.pack(column.typecode.encode('ascii'), len(column)))
+            parts.append(column.tobytes())
+        return b''.join(parts)
+
+    @classmethod
+    def loads(cls, data):
+        """
+        :param data: bytes dumps made
+        :return: Parser.Beatmap or None if the data is from another version, another byte order or broken
+        """
+        try:
+            magic, version, little = BeatmapCache.header.unpack_from(data, 0)
+            if magic != BeatmapCache.magic or version != BeatmapCache.version or little != (sys.byteorder == 'little'):
+                return None
+            position = BeatmapCache.header.size
+            (length,) = struct.unpack_from('<I', data, position)
+            position += 4
+            beatmap = Parser.Beatmap()
+            beatmap.metadata = json.loads(data[position:position + length].decode('utf8'))
+            position += length
+
+            for name in Parser.Beatmap.columns:
+                typecode, count = BeatmapCache.column.unpack_from(data, position)
+                position += BeatmapCache.column.size
+                column = array(typecode.decode('ascii'))
+                size = column.itemsize * count
+                column.frombytes(data[position:position + size])
+                if len(column) != count:
+                    return None
+                position += size
+                setattr(beatmap, name, column)
+            return beatmap
+        except (struct.error, ValueError, UnicodeDecodeError):
+            return None
+
+    def load(self, path):
+        """
+        :param path: .osu file
+        :return: the cached Parser.Beatmap or None on a miss
+        """
+        entry = self.entry(self.key(path))
+        try:
+            with open(entry, 'rb') as file:
+                beatmap = BeatmapCache.loads(file.read())
+        except OSError:
+            return None
+        if beatmap is not None:
+            os.utime(entry)
+        return beatmap
+
+    def store(self, path, beatmap):
+        # written to a temporary file first, concurrent readers never see half an entry
+        handle, temporary = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as file:
+            file.write(BeatmapCache.dumps(beatmap))
+        os.replace(temporary, self.entry(self.key(path)))
+        self.evict()
+
+    def get(self, path):
+        """
+        the parsed beatmap of an .osu, parsed and stored if it isn't cached yet
+        :param path: .osu file
+        :return: Parser.Beatmap
+        """
+        beatmap = self.load(path)
+        if beatmap is not None:
+            self.hits += 1
+            return beatmap
+        self.misses += 1
+        beatmap = Parser.OsuParser(path).parse()
+        self.store(path, beatmap)
+        return beatmap
+
+    def evict(self):
+        # drops the least recently used entries until the cache fits max_bytes again
+        entries = list()
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith('.bin') and entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(entry)
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith('.bin'):
+                os.remove(entry.path)
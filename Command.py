@@ -1,4 +1,14 @@
+from array import array
+from bisect import bisect_left
+from copy import copy
+import time
+from Timing import TimingMap
+import Easing
+
+
 class Command:
+    # no per-instance __dict__, generated storyboards hold millions of these
+    __slots__ = ('t', 'easing', 'start_time', 'end_time')
 
     def __init__(self, t, easing, start_time, end_time):
         # Type and easing
@@ -36,6 +46,10 @@ class Command:
 
     @classmethod
     def milliseconds(cls, time_string) -> int:
+        # plain timestamps are the most common input by far
+        if type(time_string) is int and time_string >= 0:
+            return time_string
+
         # ascertain that whatever is thrown in is handled as a string and stripped off characters that make no sense
         components = str(time_string).strip('[- ]').split(':')
 
@@ -46,6 +60,70 @@ class Command:
             return int(round(float(components[0])))
         return 0  # throw out a 0 in all other cases
 
+    @classmethod
+    def visible_mask(cls, types, start_times, end_times) -> list:
+        """
+        decides which commands are worth rendering: a command is hidden if another command of the same type
+        starts strictly before and ends strictly after it. Sweeps once over the commands per type instead of
+        comparing every command against every other one
+        :param types: command types, ordered by start time
+        :param start_times: start times in the same order
+        :param end_times: end times in the same order
+        :return: list of bools, True for every command that has to be rendered
+        """
+        # type -> [start of the current group of equal starts, max end of all earlier groups, max end of the group]
+        sweep = dict()
+        mask = list()
+
+        for t, start, end in zip(types, start_times, end_times):
+            # loops are never hidden and don't hide anything themselves, their children are checked separately
+            if t == 'L':
+                mask.append(True)
+                continue
+
+            state = sweep.get(t)
+            if state is None:
+                state = sweep[t] = [start, None, end]
+            elif start > state[0]:
+                # a later start begins, the previous group may now contain this and any following command
+                state[1] = state[2] if state[1] is None else max(state[1], state[2])
+                state[0] = start
+                state[2] = end
+            elif end > state[2]:
+                state[2] = end
+
+            # only commands that started strictly earlier can contain this one
+            mask.append(state[1] is None or state[1] <= end)
+
+        return mask
+
+    @classmethod
+    def visible(cls, commands) -> list:
+        """
+        filters a list of commands sorted by start time down to the ones worth rendering
+        :param commands: commands sorted by start time
+        :return: the visible commands in the same order
+        """
+        mask = Command.visible_mask([c.t for c in commands], [c.start_time for c in commands],
+                                    [c.end_time for c in commands])
+        visible = [command for command, keep in zip(commands, mask) if keep]
+
+        # the iterations of loop children hide plain commands the same way
+        loops = LoopIndex(command for command in visible if command.t == 'L')
+        if loops:
+            visible = [command for command in visible if command.t == 'L' or
+                       not loops.hides(command.t, command.start_time, command.end_time)]
+        return visible
+
+    def key(self):
+        """
+        everything that makes up a command, unlike __eq__ and __hash__ this includes the parameters
+        :return: hashable tuple or None if the command can't be compared as a whole
+        """
+        if not hasattr(self, 'params'):
+            return None
+        return (type(self), self.t, self.easing, self.start_time, self.end_time) + self.params()
+
     @classmethod
     def get_subclasses_as_dict(cls):
         subclasses = set(cls.__subclasses__())
@@ -56,14 +134,24 @@ class Command:
 
     # global render command: gives back whatever additional attribs the command has
     def render(self, *args) -> str:
-        base_string = ' {},{},{},{}'.format(self.t, self.easing, self.start_time, self.end_time)
-        for arg in args:
-            base_string += ',{}'.format(arg)
-        return base_string
+        return ' ' + ','.join(['{},{},{},{}'.format(self.t, self.easing, self.start_time, self.end_time)] +
+                              ['{}'.format(arg) for arg in args])
+
+    # lines this command renders to without line breaks, most commands are exactly one line
+    def iter_lines(self):
+        yield self.render()
+
+    def shifted(self, offset):
+        # copy of the command moved in time
+        command = copy(self)
+        command.start_time += offset
+        command.end_time += offset
+        return command
 
 
 # Fade
 class F(Command):
+    __slots__ = ('s_opacity', 'e_opacity')
 
     def __init__(self, easing, start_time, end_time, start_opacity, end_opacity):
         super().__init__('F', easing, start_time, end_time)
@@ -80,12 +168,16 @@ class F(Command):
         else:
             return o
 
+    def params(self):
+        return (self.s_opacity,), (self.e_opacity,)
+
     def render(self):
         return super().render(self.s_opacity, self.e_opacity)
 
 
 # Move (both axis)
 class M(Command):
+    __slots__ = ('start_x', 'start_y', 'end_x', 'end_y')
 
     def __init__(self, easing, start_time, end_time, start_x, start_y, end_x, end_y):
         super().__init__('M', easing, start_time, end_time)
@@ -94,33 +186,48 @@ class M(Command):
         self.end_x = int(end_x)
         self.end_y = int(end_y)
 
+    def params(self):
+        return (self.start_x, self.start_y), (self.end_x, self.end_y)
+
     def render(self):
         return super().render(self.start_x, self.start_y, self.end_x, self.end_y)
 
 
 # MX and MY could be the same class, but aren't for the case where they need different handling of any kind
 class MX(Command):
+    __slots__ = ('start_x', 'end_x')
+
     def __init__(self, easing, start_time, end_time, start_x, end_x):
         super().__init__('MX', easing, start_time, end_time)
         self.start_x = int(start_x)
         self.end_x = int(end_x)
 
+    def params(self):
+        return (self.start_x,), (self.end_x,)
+
     def render(self):
         return super().render(self.start_x, self.end_x)
 
 
 class MY(Command):
+    __slots__ = ('start_y', 'end_y')
+
     def __init__(self, easing, start_time, end_time, start_y, end_y):
         super().__init__('MY', easing, start_time, end_time)
         self.start_y = int(start_y)
         self.end_y = int(end_y)
 
+    def params(self):
+        return (self.start_y,), (self.end_y,)
+
     def render(self):
         return super().render(self.start_y, self.end_y)
 
 
 # Scale
 class S(Command):
+    __slots__ = ('start_scale', 'end_scale')
+
     def __init__(self, easing, start_time, end_time, start_scale, end_scale):
         super().__init__('S', easing, start_time, end_time)
         self.start_scale = S.scale(start_scale)
@@ -134,34 +241,49 @@ class S(Command):
         else:
             return s
 
+    def params(self):
+        return (self.start_scale,), (self.end_scale,)
+
     def render(self):
         return super().render(self.start_scale, self.end_scale)
 
 
 # Vector Scale
 class V(Command):
+    __slots__ = ('start_scale_x', 'start_scale_y', 'end_scale_x', 'end_scale_y')
+
     def __init__(self, easing, start_time, end_time, start_scale_x, start_scale_y, end_scale_x, end_scale_y):
         super().__init__('V', easing, start_time, end_time)
         self.start_scale_x = S.scale(start_scale_x)
+        self.start_scale_y = S.scale(start_scale_y)
         self.end_scale_x = S.scale(end_scale_x)
-        self.start_scale_x = S.scale(start_scale_y)
-        self.end_scale_x = S.scale(end_scale_y)
+        self.end_scale_y = S.scale(end_scale_y)
+
+    def params(self):
+        return (self.start_scale_x, self.start_scale_y), (self.end_scale_x, self.end_scale_y)
 
     def render(self):
-        return super().render(self.start_scale_x, self.start_scale_y, self.end_scale.x, self.end_scale_y)
+        return super().render(self.start_scale_x, self.start_scale_y, self.end_scale_x, self.end_scale_y)
 
 
 class R(Command):
+    __slots__ = ('start_rotate', 'end_rotate')
+
     def __init__(self, easing, start_time, end_time, start_rotate, end_rotate):
         super().__init__('R', easing, start_time, end_time)
         self.start_rotate = float(start_rotate)
         self.end_rotate = float(end_rotate)
 
+    def params(self):
+        return (self.start_rotate,), (self.end_rotate,)
+
     def render(self):
         return super().render(self.start_rotate, self.end_rotate)
 
 
 class C(Command):
+    __slots__ = ('start_rgb', 'end_rgb')
+
     def __init__(self, easing, start_time, end_time, s_rgb, e_rgb):
         super().__init__('C', easing, start_time, end_time)
         self.start_rgb = (C.rgb(s_rgb[0]), C.rgb(s_rgb[1]), C.rgb(s_rgb[2]))
@@ -175,6 +297,9 @@ class C(Command):
 
         return cls(easing, start_time, end_time, start_rgb, end_rgb)
 
+    def params(self):
+        return self.start_rgb, self.end_rgb
+
     def render(self):
         return super().render(self.start_rgb[0], self.start_rgb[1], self.start_rgb[2],
                               self.end_rgb[0], self.end_rgb[1], self.end_rgb[2])
@@ -199,8 +324,10 @@ class C(Command):
 
 
 class P(Command):
+    __slots__ = ('param',)
+
     def __init__(self, easing, start_time, end_time, param):
-        super().__init__('C', easing, start_time, end_time)
+        super().__init__('P', easing, start_time, end_time)
         self.param = str(param).upper()
 
     def render(self):
@@ -208,31 +335,380 @@ class P(Command):
 
 
 class L(Command):
+    __slots__ = ('loop_count', 'commands')
+
     def __init__(self, start_time, loop_count):
-        self.start_time = Command.milliseconds(start_time)
+        super().__init__('L', 0, start_time, start_time)
         self.loop_count = int(loop_count)
         self.commands = []
 
+    # loops with the same start can still hold entirely different children, so never treat two as duplicates
+    def __eq__(self, other):
+        return self is other
+
+    def __hash__(self):
+        return id(self)
+
     def add(self, command):
         if isinstance(command, Command):
             self.commands.append(command)
+            self.update()
 
     def rem(self, command):
         if isinstance(command, Command):
             self.commands.remove(command)
+            self.update()
+
+    def children(self) -> list:
+        # the children the same way sprites filter their commands: deduplicated, sorted and unoccluded
+        return Command.visible(sorted(dict.fromkeys(self.commands)))
+
+    def first_start(self) -> int:
+        # children are relative to the loop start, the first iteration begins with the earliest child
+        return min((command.start_time for command in self.commands), default=0)
+
+    def duration(self) -> int:
+        # length of one iteration, osu! starts the next one right after the last child of the previous one ended
+        if not self.commands:
+            return 0
+        return max(command.end_time for command in self.commands) - self.first_start()
+
+    def update(self):
+        # the loop spans all of its iterations, which is what sorting and occlusion of the sprite work with
+        self.end_time = self.start_time + self.first_start() + self.duration() * self.loop_count
+
+    def expand(self):
+        """
+        lazily walks over every iteration, only one command exists at a time
+        :return: generator of the children moved to absolute times, iteration by iteration
+        """
+        children = self.children()
+        duration = self.duration()
+        for iteration in range(self.loop_count):
+            offset = self.start_time + iteration * duration
+            for command in children:
+                yield command.shifted(offset)
+
+    def contains(self, t, start_time, end_time) -> bool:
+        """
+        checks if any iteration of a child of the same type starts strictly before and ends strictly after the
+        given span, without expanding the loop
+        :param t: command type
+        :param start_time: absolute start of the span
+        :param end_time: absolute end of the span
+        :return: True if the loop hides a command with that span
+        """
+        if self.loop_count < 1:
+            return False
+        duration = self.duration()
 
-    # this actually needs to filter its children the same way sprites do but I didn't implement that yet
-    # maybe I can reuse the sprite's checks and isolate that functionality somewhere else
-    def render(self):
-        format_str = ' L,{},{}'.format(self.start_time, self.loop_count)
         for command in self.commands:
-            format_str += '\n ' + command.render()
-        return format_str
+            if command.t != t:
+                continue
+            # iteration k covers it if k * duration < upper and k * duration > lower
+            upper = start_time - self.start_time - command.start_time
+            lower = end_time - self.start_time - command.end_time
+            if duration == 0:
+                if lower < 0 < upper:
+                    return True
+                continue
+            first = max(0, lower // duration + 1)
+            last = min(self.loop_count - 1, -(-upper // duration) - 1)
+            if first <= last:
+                return True
+        return False
+
+    def iter_lines(self):
+        yield ' L,{},{}'.format(self.start_time, self.loop_count)
+        for command in self.children():
+            yield ' ' + command.render()
+
+    def render(self):
+        return '\n'.join(self.iter_lines())
+
+
+
+# Looks up which loops of an object could hide a command. Loops are kept per child type and sorted by when their first
+# iteration of that type starts, so a command is only compared with loops that started before it and still reach past
+# its end instead of with every loop of the object
+class LoopIndex:
+    def __init__(self, loops):
+        """
+        :param loops: loops of one object
+        """
+        spans = dict()      # type -> list of (earliest start, latest end, loop) of the children of that type
+        for loop in loops:
+            if loop.loop_count < 1:
+                continue
+            last = loop.start_time + loop.duration() * (loop.loop_count - 1)
+            for t in {command.t for command in loop.commands}:
+                children = [command for command in loop.commands if command.t == t]
+                spans.setdefault(t, list()).append((loop.start_time + min(c.start_time for c in children),
+                                                    last + max(c.end_time for c in children), loop))
+
+        self.starts = dict()    # type -> sorted earliest starts
+        self.reach = dict()     # type -> latest end of all loops up to each position
+        self.loops = dict()     # type -> loops in the same order
+        for t, entries in spans.items():
+            entries.sort(key=lambda entry: entry[0])
+            self.starts[t] = [entry[0] for entry in entries]
+            self.loops[t] = [entry[2] for entry in entries]
+            reach = list()
+            for entry in entries:
+                reach.append(entry[1] if not reach else max(reach[-1], entry[1]))
+            self.reach[t] = reach
+
+    def __bool__(self):
+        return bool(self.loops)
+
+    def hides(self, t, start_time, end_time) -> bool:
+        """
+        :return: True if an iteration of any of the loops hides a command with that type and span, see L.contains
+        """
+        starts = self.starts.get(t)
+        if starts is None:
+            return False
+        reach = self.reach[t]
+        loops = self.loops[t]
+        # only loops starting strictly before can contain the span, walked back until none of the earlier ones
+        # reaches past its end anymore
+        for i in range(bisect_left(starts, start_time) - 1, -1, -1):
+            if reach[i] <= end_time:
+                return False
+            if loops[i].contains(t, start_time, end_time):
+                return True
+        return False
+
+
+# Columnar storage for plain commands: one typed array per attribute instead of one python object per command
+class CommandTable:
+    # type -> (parameters per end, how a single value is cleaned up, what the value is rendered as)
+    spec = {'F': (1, F.opacity, float),
+            'M': (2, int, int),
+            'MX': (1, int, int),
+            'MY': (1, int, int),
+            'S': (1, S.scale, float),
+            'V': (2, S.scale, float),
+            'R': (1, float, float),
+            'C': (3, C.rgb, int)}
+    type_names = tuple(spec)                            # the position of a type in here is what gets stored
+    type_ids = {t: i for i, t in enumerate(type_names)}
+    stride = 6                                          # parameter slots per row, 3 start and 3 end values
+
+    def __init__(self):
+        self.types = array('B')         # index into CommandTable.type_names
+        self.easings = array('B')
+        self.start_times = array('i')
+        self.end_times = array('i')
+        self.params = array('d')        # stride values per row, start values first, unused slots are 0
+        self.ordered = True             # rows are deduplicated and sorted by start time
+
+    def __len__(self):
+        return len(self.types)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.row(i)
+
+    @classmethod
+    def accepts(cls, command) -> bool:
+        # only the plain command classes, anything else (loops, parameters, custom subclasses) renders itself
+        return command.t in CommandTable.spec and type(command).__name__ == command.t
+
+    def append(self, command):
+        start_params, end_params = command.params()
+        self.add(command.t, command.easing, command.start_time, command.end_time, start_params, end_params)
+
+    def add(self, t, easing, start_time, end_time, start_params, end_params):
+        """
+        adds a row without building a command object first
+        :param t: command type, one of CommandTable.type_names
+        :param easing: easing
+        :param start_time: start time
+        :param end_time: end time
+        :param start_params: tuple of start values
+        :param end_params: tuple of end values
+        """
+        count, clean, _ = CommandTable.spec[t]
+        start = CommandTable.milliseconds(start_time)
+        end = CommandTable.milliseconds(end_time)
+
+        # same as commands themselves, assume start and end were swapped on accident
+        if start > end:
+            start, end = end, start
+
+        padding = [0.0] * (3 - count)
+        self.types.append(CommandTable.type_ids[t])
+        self.easings.append(int(easing))
+        self.start_times.append(start)
+        self.end_times.append(end)
+        self.params.extend([clean(v) for v in start_params[:count]] + padding +
+                           [clean(v) for v in end_params[:count]] + padding)
+        self.ordered = False
+
+    def extend_rows(self, types, easings, start_times, end_times, params):
+        """
+        adds a batch of rows that are already in the form the columns store, e.g. straight out of a parser
+        :param types: positions of the types in CommandTable.type_names
+        :param easings: easings
+        :param start_times: start times in whole ms, none after its end time
+        :param end_times: end times in whole ms
+        :param params: stride cleaned values per row, start values then end values each padded to 3
+        """
+        self.types.extend(types)
+        self.easings.extend(easings)
+        self.start_times.extend(start_times)
+        self.end_times.extend(end_times)
+        self.params.extend(params)
+        self.ordered = False
+
+    @classmethod
+    def milliseconds(cls, time) -> int:
+        # numbers that are already valid times skip the string handling of Command.milliseconds
+        if isinstance(time, (int, float)) and time >= 0:
+            return int(round(time))
+        return Command.milliseconds(time)
+
+    def remove(self, command):
+        """
+        removes the first row equal to command including its parameters
+        :param command: command to remove
+        """
+        start_params, end_params = command.params()
+        for i in range(len(self)):
+            if CommandTable.type_names[self.types[i]] == command.t and self.easings[i] == command.easing and \
+                    self.start_times[i] == command.start_time and self.end_times[i] == command.end_time and \
+                    self.row_params(i) == (start_params, end_params):
+                stride = CommandTable.stride
+                del self.types[i], self.easings[i], self.start_times[i], self.end_times[i]
+                del self.params[i * stride:(i + 1) * stride]
+                return
+        raise ValueError('CommandTable.remove(command): command not in table', command.render())
+
+    def row_params(self, i):
+        """
+        :param i: row index
+        :return: tuple of start values and tuple of end values of the row, typed like the command would hold them
+        """
+        count, _, out = CommandTable.spec[CommandTable.type_names[self.types[i]]]
+        base = i * CommandTable.stride
+        return (tuple(out(v) for v in self.params[base:base + count]),
+                tuple(out(v) for v in self.params[base + 3:base + 3 + count]))
+
+    def row(self, i):
+        """
+        builds an ordinary command object out of a row
+        :param i: row index
+        :return: command instance
+        """
+        t = CommandTable.type_names[self.types[i]]
+        start_params, end_params = self.row_params(i)
+        subclass = Command.get_subclasses_as_dict()[t]
+        if t == 'C':
+            return subclass(self.easings[i], self.start_times[i], self.end_times[i], start_params, end_params)
+        return subclass(self.easings[i], self.start_times[i], self.end_times[i], *start_params, *end_params)
+
+    def order(self):
+        """
+        deduplicates rows the same way sprites deduplicate commands (type, easing, start and end, first one wins)
+        and sorts the rest by start time, rewriting all columns in that order
+        """
+        if self.ordered:
+            return
+
+        first = dict()
+        for i, key in enumerate(zip(self.types, self.easings, self.start_times, self.end_times)):
+            first.setdefault(key, i)
+        rows = sorted(first.values(), key=self.start_times.__getitem__)
+
+        stride = CommandTable.stride
+        params = array('d')
+        for i in rows:
+            params.extend(self.params[i * stride:(i + 1) * stride])
+
+        self.types = array('B', [self.types[i] for i in rows])
+        self.easings = array('B', [self.easings[i] for i in rows])
+        self.start_times = array('i', [self.start_times[i] for i in rows])
+        self.end_times = array('i', [self.end_times[i] for i in rows])
+        self.params = params
+        self.ordered = True
+
+    def visible_rows(self) -> list:
+        """
+        orders the table and filters out rows fully contained by another row of the same type
+        :return: list of row indices worth rendering, sorted by start time
+        """
+        self.order()
+        mask = Command.visible_mask(self.types, self.start_times, self.end_times)
+        return [i for i, keep in enumerate(mask) if keep]
+
+    def iter_rendered(self, loops=()):
+        """
+        renders all visible rows in one go
+        :param loops: loops of the same object, rows hidden by any of their iterations are skipped
+        :return: generator of (start time, rendered line) tuples sorted by start time
+        """
+        templates = [' {},{{}},{{}},{{}}'.format(t) + ',{}' * (2 * CommandTable.spec[t][0])
+                     for t in CommandTable.type_names]
+        outs = [CommandTable.spec[t][2] for t in CommandTable.type_names]
+        counts = [CommandTable.spec[t][0] for t in CommandTable.type_names]
+        rows = self.visible_rows()      # orders the table first, which replaces the columns
+        loops = LoopIndex(loops)
+        params = self.params
+        stride = CommandTable.stride
+
+        for i in rows:
+            t = self.types[i]
+            if loops and loops.hides(CommandTable.type_names[t], self.start_times[i], self.end_times[i]):
+                continue
+            out = outs[t]
+            base = i * stride
+            values = [out(v) for v in params[base:base + counts[t]]] + \
+                     [out(v) for v in params[base + 3:base + 3 + counts[t]]]
+            yield self.start_times[i], templates[t].format(self.easings[i], self.start_times[i],
+                                                             self.end_times[i], *values)
+
+    def nbytes(self) -> int:
+        # memory held by the columns themselves
+        return sum(a.itemsize * len(a) for a in (self.types, self.easings, self.start_times, self.end_times,
+                                                  self.params))
+
+
+# Flyweight pool: hands out one shared instance for every set of identical commands, e.g. the same fade-in
+# attached to thousands of particles. Commands that went through the pool must be treated as immutable
+class CommandPool:
+    def __init__(self):
+        self.commands = dict()      # Command.key() -> shared instance
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.commands)
+
+    def intern(self, command):
+        """
+        :param command: freshly built command
+        :return: the shared instance equal to command, loops and other commands without a key are returned as is
+        """
+        key = command.key()
+        if key is None:
+            return command
+
+        shared = self.commands.get(key)
+        if shared is None:
+            self.commands[key] = command
+            self.misses += 1
+            return command
+
+        self.hits += 1
+        return shared
 
 
 class Factory:
-    def __init__(self, timing):
-        self.timing_points = timing     # dictionary containing all timing points of a song
+    def __init__(self, timing, pool=None, profiler=None):
+        # timing map of the song, a plain timing point dictionary gets indexed once here
+        self.timing_map = timing if isinstance(timing, TimingMap) else TimingMap(timing)
+        self.timing_points = self.timing_map.timing_points  # dictionary containing all timing points of a song
         self.t = None                   # type of the command to be generated, determines what is used upon rendering
         self.ease = None                # Easing
         self.start_time = None          # start time in ms
@@ -240,6 +716,14 @@ class Factory:
         self.end_time = None            # endtime
         self.tupS = None                # tuple representing the start parameters of the command
         self.tupE = None                # tuple representing the end parameters of the command
+        self.pool = pool                # optional CommandPool built commands get interned in
+        self.profiler = profiler        # optional Profiler.Profiler every build is reported to
+
+    def __getstate__(self):
+        # profilers hold hooks that don't pickle, copies sent to other processes go without
+        state = self.__dict__.copy()
+        state['profiler'] = None
+        return state
 
     # sets the type
     def type(self, t):
@@ -273,25 +757,9 @@ class Factory:
     # calculates the end time if the duration is set and returns that
     def calc_end_time(self):
         if self.dura is not None:
-            # init relevant start dict
-            relevant_timing_point = {}
-
-            # start is set to something already
-            if self.start_time is not None:
-                # loop over timing points until the first timing point that
-                # applies to the relevant starting section is hit
-                for timing_point, content in self.timing_points.items():
-                    if content['offset'] <= self.start_time:
-                        relevant_timing_point = content
-                        break   # kill loop upon first match
-
-            # pretend reference is initial and just refer to the
-            # bpm settings of the last timing point if nothing was found
-            if relevant_timing_point == {}:
-                relevant_timing_point = self.timing_points[0]
-
-            # e.g. 400 ms per beat * 1 / 2 = half a beat if 1 beat is 400 ms
-            return self.start_time + (relevant_timing_point['ms'] * float(self.dura[0]) / float(self.dura[1]))
+            # commands without a start begin at 0, the same as build assumes
+            start = self.start_time if self.start_time is not None else 0
+            return start + self.timing_map.to_ms(start, self.dura)
         if self.end_time is not None:
             return self.end_time
         return 0
@@ -377,37 +845,68 @@ class Factory:
         return self
 
     def reset(self):
-        self.__init__(self.timing_points)
+        self.__init__(self.timing_map, self.pool, self.profiler)
 
     def to_ms(self, reference_timestamp, duration):
-        # init
-        relevant_timing_point = dict()
-
         # assure that the reference timestamp is formatted to be an int
         ref_timestamp = Command.milliseconds(reference_timestamp)
 
-        # split the duration fraction
-        dur = duration.split('/')
-
         # nothing makes sense if you never gave this function a fraction
-        if len(dur) == 2:
+        if len(duration.split('/')) == 2:
+            return int(round(self.timing_map.to_ms(ref_timestamp, duration)))
+
+    def many_to_ms(self, reference_timestamps, durations):
+        """
+        converts lots of beat fractions to ms in one go
+        :param reference_timestamps: sequence of times the durations start at
+        :param durations: a single fraction like '1/2' for all of them or a sequence of fractions
+        :return: list of lengths in ms
+        """
+        timestamps = [Command.milliseconds(timestamp) for timestamp in reference_timestamps]
+        return [int(round(ms)) for ms in self.timing_map.many_to_ms(timestamps, durations)]
+
+    def snap(self, time, divisor=1):
+        # snaps a timestamp to the closest 1/divisor beat of the timing point it's in
+        return self.timing_map.snap(Command.milliseconds(time), divisor)
 
-            # loop through timing points
-            for timing_point, content in self.timing_points.items():
-                if content['offset'] <= ref_timestamp:
-                    relevant_timing_point = content
-                    break
+    @classmethod
+    def arguments(cls, t, start_params, end_params):
+        """
+        the type dispatch of the builder: picks the values a command type takes out of the parameter tuples
+        :param t: command type
+        :param start_params: tuple with start values
+        :param end_params: tuple with end values
+        :return: tuple of start values and tuple of end values or None if they don't fit the type
+        """
+        if start_params is None or end_params is None:
+            return None
 
-            # pretend reference is initial and just refer to the
-            # bpm settings of the last timing point if nothing was found
-            if relevant_timing_point == {}:
-                relevant_timing_point = self.timing_points[0]
+        if t == "F" or t == "MX" or t == "S" or t == "R":  # subclasses with 2 params take the first tuple entry
+            if 0 < len(start_params) <= 2 and 0 < len(end_params) <= 2:
+                return start_params[:1], end_params[:1]
+        elif t == "M" or t == "V":                         # subclasses expecting 2 params need two to be set
+            if len(start_params) == 2 and len(end_params) == 2:
+                return tuple(start_params), tuple(end_params)
+        elif t == "MY":                                    # subclass that takes the last available (y coord)
+            param_s = start_params[-1] if 0 < len(start_params) <= 2 else 0
+            param_e = end_params[-1] if 0 < len(end_params) <= 2 else 0
+            return (param_s,), (param_e,)
+        elif t == "C":                                      # subclass expecting 3 values
+            if len(start_params) == 3 and len(end_params) == 3:
+                return tuple(start_params), tuple(end_params)
+        return None
 
-            # e.g. 400 ms per beat * 1 / 2 = half a beat if 1 beat is 400 ms
-            return int(round(relevant_timing_point['ms'] * float(dur[0]) / float(dur[1])))
+    @classmethod
+    def construct(cls, subclass, easing, start, end, start_values, end_values):
+        # colors take their values as tuples, every other command takes them one by one
+        if subclass is C:
+            return subclass(easing, start, end, start_values, end_values)
+        return subclass(easing, start, end, *start_values, *end_values)
 
     # builds from the parameters it knows
     def build(self):
+        clock = time.perf_counter() if self.profiler is not None else 0
+
         # get all current attributes to the local scope to not accidentally modify class attributes which could cause
         # different results upon running
         t = self.t                      # type
@@ -426,36 +925,205 @@ class Factory:
             easing = 0
 
         # type has to be set or else the builder doesnt know what the actual arguments mean
-        if t == "F" or t == "MX" or t == "S" or t == "R":  # subclasses with 2 params take the first tuple entry
-            if len(start_params) <= 2 and len(end_params) <= 2:
-                return subclasses[t](easing, start, end, start_params[0], end_params[0])
-        elif t == "M" or t == "V":                         # subclasses expecting 2 params need two to be set
-            if len(start_params) == 2 and len(end_params) == 2:
-                return subclasses[t](easing, start, end, start_params[0], start_params[1],
-                                     end_params[0], end_params[1])
-        elif t == "MY":                                    # subclass that takes the last available (y coord)
-            param_s = 0
-            param_e = 0
-            if start_params is not None and end_params is not None:
-                if len(start_params) == 1:
-                    param_s = start_params[0]
-                elif len(start_params) == 2:
-                    param_s = start_params[1]
-                if len(end_params) == 1:
-                    param_e = end_params[0]
-                elif len(end_params) == 2:
-                    param_e = end_params[1]
-                return subclasses[t](easing, start, end, param_s, param_e)
-        elif t == "C":                                      # subclass expecting 3 values
-            if len(start_params) == 3 and len(end_params) == 3:
-                return subclasses[t](easing, start, end, start_params[0], start_params[1], start_params[2],
-                                     end_params[0], end_params[1], end_params[2])
+        arguments = Factory.arguments(t, start_params, end_params)
+        if t in subclasses and arguments is not None:
+            command = Factory.construct(subclasses[t], easing, start, end, *arguments)
+            if self.pool is not None:
+                command = self.pool.intern(command)
+            if self.profiler is not None:
+                self.profiler.build(t, time.perf_counter() - clock)
+            return command
 
         # if the code makes it to here it didn't return any command so far, at that point it should fail over and
         # give the caller stack tracing information
         raise ValueError('The command couln\'t be built because it is either '
                          'unknown to the builder or is missing required arguments',
-                         self.t, self.easing, self.start_time, self.end_time, self.tupS, self.tupE)
-
-
+                         self.t, self.ease, self.start_time, self.end_time, self.tupS, self.tupE)
+
+    def build_many(self, start_times, durations=None, start_params=None, end_params=None, table=None):
+        """
+        builds a whole batch of commands of the type and easing set on the factory in one pass
+        :param start_times: sequence of start times
+        :param durations: one beat fraction for all commands or a sequence of fractions, defaults to the duration set
+        :param start_params: sequence of start values per command (numbers or tuples), defaults to the ones set
+        :param end_params: sequence of end values per command, defaults to the ones set or the start values
+        :param table: CommandTable to write the rows into instead of creating command objects
+        :return: list of commands or the table
+        """
+        t = self.t
+        easing = self.ease if self.ease is not None else 0
+        starts = [Command.milliseconds(start) for start in start_times]
+        count = len(starts)
+
+        # durations are mandatory here, there is no sensible shared end time for a batch
+        if durations is None and self.dura is not None:
+            durations = '/'.join(self.dura)
+        if durations is None:
+            raise ValueError('The batch couldn\'t be built because no duration is set', t)
+        lengths = self.timing_map.many_to_ms(starts, durations)
+
+        # fall back to what the factory knows, same as build does
+        if start_params is None:
+            start_params = [self.tupS] * count
+            if end_params is None:
+                end_params = [self.tupE if self.tupE is not None else self.tupS] * count
+        elif end_params is None:
+            end_params = start_params
 
+        if not (len(lengths) == len(start_params) == len(end_params) == count):
+            raise ValueError('The batch couldn\'t be built because the sequences differ in length',
+                             count, len(lengths), len(start_params), len(end_params))
+
+        # everything the builder dispatches on only gets looked up once for the whole batch
+        subclass = Command.get_subclasses_as_dict().get(t)
+        arguments = Factory.arguments
+        construct = Factory.construct
+        commands = list()
+        last = (None, None, None)
+
+        for start, length, start_value, end_value in zip(starts, lengths, start_params, end_params):
+            # rows sharing the same parameter objects share their dispatch as well
+            if start_value is not last[0] or end_value is not last[1]:
+                args = arguments(t,
+                                 start_value if isinstance(start_value, (tuple, list)) else (start_value,),
+                                 end_value if isinstance(end_value, (tuple, list)) else (end_value,))
+                if subclass is None or args is None:
+                    raise ValueError('The command couln\'t be built because it is either '
+                                     'unknown to the builder or is missing required arguments',
+                                     t, easing, start, start_value, end_value)
+                last = (start_value, end_value, args)
+
+            if table is not None:
+                table.add(t, easing, start, start + length, *last[2])
+            else:
+                commands.append(construct(subclass, easing, start, start + length, *last[2]))
+
+        if self.pool is not None:
+            commands = [self.pool.intern(command) for command in commands]
+        return table if table is not None else commands
+
+    def bake(self, function, start_time, end_time, tolerance=1.0, step=10, easings=None, table=None):
+        """
+        turns an arbitrary function of time into as few commands of the type set on the factory as possible,
+        every segment is grown for as long as one of the easings keeps it within tolerance of the function
+        :param function: function of the time in ms returning a value or a tuple of values for the type
+        :param start_time: start of the curve
+        :param end_time: end of the curve
+        :param tolerance: largest allowed difference between the commands and the function at any whole ms. Values
+        out of the range of the type are clamped first, types holding whole numbers allow at least 0.5 as their
+        endpoints are rounded
+        :param step: ms between the times segments may start and end at, steps that can't be kept within tolerance
+        are split at every ms
+        :param easings: easing ids to try, defaults to the ones that don't overshoot (0 to 23)
+        :param table: CommandTable to write the rows into instead of creating command objects
+        :return: list of commands or the table
+        """
+        t = self.t
+        if t not in CommandTable.spec:
+            raise ValueError('The curve couldn\'t be baked because the type is unknown to the builder', t)
+        count, clean, out = CommandTable.spec[t]
+        ids = list(range(24)) if easings is None else list(easings)
+        easings = [Easing.function(easing) for easing in ids]
+
+        # sample the function, the end is always a sample
+        start = Command.milliseconds(start_time)
+        end = Command.milliseconds(end_time)
+        times = list(range(start, end, max(1, int(step)))) + [end]
+
+        # the values a command would actually end up holding, e.g. clamped opacities or rounded coordinates
+        def held(value):
+            return tuple(out(clean(round(v) if out is int else v)) for v in value)
+
+        # what the commands are measured against: whatever the type can't reach is clamped away, rounded types are
+        # compared with the exact value instead, their endpoints alone can already be half a unit off it
+        def target(value):
+            return value if out is int else tuple(clean(v) for v in value)
+
+        limit = max(tolerance, 0.5) if out is int else tolerance
+        cache = dict()          # time -> (held, target) value of the function, every whole ms is evaluated once
+
+        def evaluate(time):
+            pair = cache.get(time)
+            if pair is None:
+                value = function(time)
+                value = tuple(value) if isinstance(value, (tuple, list)) else (value,)
+                pair = cache[time] = (held(value[:count]), target(value[:count]))
+            return pair
+
+        values = [evaluate(time) for time in times]
+
+        def fit(first, last):
+            # best easing for a segment between two samples, None if none stays within the tolerance. The samples
+            # rule out most easings cheaply, the ones left are checked at every whole ms of the segment
+            a = values[first][0]
+            b = values[last][0]
+            duration = times[last] - times[first]
+            best = None
+            for easing, ease in zip(ids, easings):
+                error = 0.0
+                for k in range(first + 1, last):
+                    progress = ease((times[k] - times[first]) / duration)
+                    error = max(error, max(abs(s + (e - s) * progress - v) for s, e, v in zip(a, b, values[k][1])))
+                    if error > limit:
+                        break
+                else:
+                    for time in range(times[first] + 1, times[last]):
+                        progress = ease((time - times[first]) / duration)
+                        error = max(error, max(abs(s + (e - s) * progress - v)
+                                               for s, e, v in zip(a, b, evaluate(time)[1])))
+                        if error > limit:
+                            break
+                if error <= limit and (best is None or error < best[1]):
+                    best = (easing, error)
+                    if error == 0.0:
+                        break
+            return best
+
+        segments = list()       # [easing, start, end, start values, end values]
+        i = 0
+        while i < len(times) - 1:
+            # gallop ahead while segments still fit, then narrow down on the longest one that does
+            good = i + 1
+            good_fit = fit(i, good)
+            if good_fit is None and times[good] - times[i] > 1:
+                # not even a single step fits, so the step gets sampled at every ms instead
+                between = list(range(times[i] + 1, times[good]))
+                times[good:good] = between
+                values[good:good] = [evaluate(time) for time in between]
+                continue
+            good_fit = good_fit or (0, 0.0)
+            reach = 2
+            while i + reach < len(times):
+                found = fit(i, i + reach)
+                if found is None:
+                    break
+                good, good_fit = i + reach, found
+                reach *= 2
+            low, high = good, min(i + reach, len(times))
+            while high - low > 1:
+                middle = (low + high) // 2
+                found = fit(i, middle)
+                if found is None:
+                    high = middle
+                else:
+                    low, good, good_fit = middle, middle, found
+
+            start_values, end_values = values[i][0], values[good][0]
+            previous = segments[-1] if segments else None
+            if previous is not None and previous[3] == previous[4] == start_values == end_values:
+                # segments split at every ms can hold the same value back to back, those become one
+                previous[2] = times[good]
+            else:
+                segments.append([good_fit[0], times[i], times[good], start_values, end_values])
+            i = good
+
+        subclass = Command.get_subclasses_as_dict()[t]
+        commands = list()
+        for easing, segment_start, segment_end, start_values, end_values in segments:
+            if table is not None:
+                table.add(t, easing, segment_start, segment_end, start_values, end_values)
+            else:
+                command = Factory.construct(subclass, easing, segment_start, segment_end, start_values, end_values)
+                commands.append(self.pool.intern(command) if self.pool is not None else command)
+
+        return table if table is not None else commands
@@ -15,5 +15,5 @@ o = {'tl': "TopLeft",
      'bc': "BottomCentre",
      'br': "BottomRight"}
 
-
-
+# Visible area in storyboard coordinates (left, right, top, bottom), widescreen included
+playfield = (-107, 747, 0, 480)
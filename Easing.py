@@ -0,0 +1,128 @@
+from array import array
+from math import cos, pi, sin, sqrt
+
+# constants osu! uses for the elastic and back easings
+elastic_const = 2 * pi / .3
+elastic_const2 = .3 / 4
+back_const = 1.70158
+back_const2 = back_const * 1.525
+
+
+def out_bounce(t):
+    if t < 1 / 2.75:
+        return 7.5625 * t * t
+    if t < 2 / 2.75:
+        t -= 1.5 / 2.75
+        return 7.5625 * t * t + .75
+    if t < 2.5 / 2.75:
+        t -= 2.25 / 2.75
+        return 7.5625 * t * t + .9375
+    t -= 2.625 / 2.75
+    return 7.5625 * t * t + .984375
+
+
+def in_out_expo(t):
+    if t < .5:
+        return .5 * 2 ** (20 * t - 10)
+    return 1 - .5 * 2 ** (-20 * t + 10)
+
+
+def in_out_elastic(t):
+    t *= 2
+    if t < 1:
+        return -.5 * 2 ** (-10 + 10 * t) * sin((1 - elastic_const2 * 1.5 - t) * elastic_const / 1.5)
+    t -= 1
+    return .5 * 2 ** (-10 * t) * sin((t - elastic_const2 * 1.5) * elastic_const / 1.5) + 1
+
+
+def in_out_back(t):
+    t *= 2
+    if t < 1:
+        return .5 * t * t * ((back_const2 + 1) * t - back_const2)
+    t -= 2
+    return .5 * (t * t * ((back_const2 + 1) * t + back_const2) + 2)
+
+
+# Easings by their osu! id, each maps the progress of a command (0 to 1) to how far along its values are
+functions = {0: lambda t: t,                                                            # Linear
+             1: lambda t: t * (2 - t),                                                  # Out (decelerate)
+             2: lambda t: t * t,                                                        # In (accelerate)
+             3: lambda t: t * t,                                                        # InQuad
+             4: lambda t: t * (2 - t),                                                  # OutQuad
+             5: lambda t: 2 * t * t if t < .5 else 1 - 2 * (t - 1) ** 2,                # InOutQuad
+             6: lambda t: t ** 3,                                                       # InCubic
+             7: lambda t: (t - 1) ** 3 + 1,                                             # OutCubic
+             8: lambda t: 4 * t ** 3 if t < .5 else 4 * (t - 1) ** 3 + 1,               # InOutCubic
+             9: lambda t: t ** 4,                                                       # InQuart
+             10: lambda t: 1 - (t - 1) ** 4,                                            # OutQuart
+             11: lambda t: 8 * t ** 4 if t < .5 else 1 - 8 * (t - 1) ** 4,              # InOutQuart
+             12: lambda t: t ** 5,                                                      # InQuint
+             13: lambda t: (t - 1) ** 5 + 1,                                            # OutQuint
+             14: lambda t: 16 * t ** 5 if t < .5 else 16 * (t - 1) ** 5 + 1,            # InOutQuint
+             15: lambda t: 1 - cos(t * pi / 2),                                         # InSine
+             16: lambda t: sin(t * pi / 2),                                             # OutSine
+             17: lambda t: .5 - .5 * cos(pi * t),                                       # InOutSine
+             18: lambda t: 2 ** (10 * (t - 1)),                                         # InExpo
+             19: lambda t: 1 - 2 ** (-10 * t),                                          # OutExpo
+             20: in_out_expo,                                                           # InOutExpo
+             21: lambda t: 1 - sqrt(1 - t * t),                                         # InCirc
+             22: lambda t: sqrt(1 - (t - 1) ** 2),                                      # OutCirc
+             23: lambda t: .5 - .5 * sqrt(1 - 4 * t * t) if t < .5 else
+             .5 + .5 * sqrt(1 - (2 * t - 2) ** 2),                                      # InOutCirc
+             24: lambda t: -2 ** (-10 + 10 * t) * sin((1 - elastic_const2 - t) * elastic_const),   # InElastic
+             25: lambda t: 2 ** (-10 * t) * sin((t - elastic_const2) * elastic_const) + 1,         # OutElastic
+             26: lambda t: 2 ** (-10 * t) * sin((.5 * t - elastic_const2) * elastic_const) + 1,    # OutElasticHalf
+             27: lambda t: 2 ** (-10 * t) * sin((.25 * t - elastic_const2) * elastic_const) + 1,   # OutElasticQuarter
+             28: in_out_elastic,                                                        # InOutElastic
+             29: lambda t: t * t * ((back_const + 1) * t - back_const),                 # InBack
+             30: lambda t: (t - 1) ** 2 * ((back_const + 1) * (t - 1) + back_const) + 1,   # OutBack
+             31: in_out_back,                                                           # InOutBack
+             32: lambda t: 1 - out_bounce(1 - t),                                       # InBounce
+             33: out_bounce,                                                            # OutBounce
+             34: lambda t: .5 - .5 * out_bounce(1 - 2 * t) if t < .5 else
+             out_bounce(2 * t - 1) * .5 + .5}                                           # InOutBounce
+
+
+def function(easing):
+    """
+    :param easing: osu! easing id
+    :return: the scalar function of the easing, unknown ids are treated as linear like osu! does
+    """
+    return functions.get(easing, functions[0])
+
+
+def ease(easing, progress) -> float:
+    """
+    scalar fast path: linear needs no call at all
+    :param easing: osu! easing id
+    :param progress: progress of the command from 0 to 1
+    :return: eased progress
+    """
+    if easing == 0:
+        return progress
+    return function(easing)(progress)
+
+
+def ease_many(easing, progress):
+    """
+    eases lots of samples at once, the easing is resolved a single time for all of them
+    :param easing: osu! easing id
+    :param progress: sequence of progresses from 0 to 1
+    :return: array of eased progresses
+    """
+    if easing == 0:
+        return array('d', progress)
+    return array('d', map(function(easing), progress))
+
+
+def interpolate_many(easing, start_value, end_value, progress):
+    """
+    eased values between two ends for lots of samples at once
+    :param easing: osu! easing id
+    :param start_value: value at progress 0
+    :param end_value: value at progress 1
+    :param progress: sequence of progresses from 0 to 1
+    :return: array of values
+    """
+    delta = end_value - start_value
+    return array('d', [start_value + delta * eased for eased in ease_many(easing, progress)])
@@ -1,29 +1,37 @@
 from Storyboard import Storyboard
 from Command import Command
-from random import randint
+from random import Random, randint
+import Constants
 
 
 class Effect:
 
-    def __init__(self, command_factory, start_time, end_time):
+    def __init__(self, command_factory, start_time, end_time, seed=None):
         self.command_factory = command_factory
         self.start_time = Command.milliseconds(start_time)
         self.end_time = Command.milliseconds(end_time)
         self.sprites = list()
 
+        # every random decision of an effect should come from here, storyboards with a seed reseed it before applying
+        self.random = Random(seed)
+
     def apply(self):
         pass
 
     def get_sprites(self):
+        # effects with lots of sprites can turn this into a generator that yields new sprites instead of appending
+        # them in apply. The storyboard then makes them while rendering and drops each one once it's written
         return self.sprites
 
     def append(self, sprite):
         self.sprites.append(sprite)
 
     @classmethod
-    def random_playfield_point(cls):
-        x = randint(-107, 747)
-        y = randint(0, 480)
+    def random_playfield_point(cls, rng=None):
+        # pass self.random to stay reproducible, without one the global generator is used
+        random_int = rng.randint if rng is not None else randint
+        x = random_int(Constants.playfield[0], Constants.playfield[1])
+        y = random_int(Constants.playfield[2], Constants.playfield[3])
         return x, y
 
 
@@ -0,0 +1,177 @@
+from multiprocessing import Pool
+import os
+import tempfile
+import Parser
+from Storyboard import Storyboard, render_sprites
+
+
+def parse_difficulty(path, beatmap_cache=None):
+    """
+    parses a single difficulty, used by the worker processes of Mapset
+    :param path: .osu file
+    :param beatmap_cache: optional Cache.BeatmapCache
+    :return: Parser.Beatmap
+    """
+    if beatmap_cache is not None:
+        return beatmap_cache.get(path)
+    return Parser.OsuParser(path).parse()
+
+
+def write_difficulty(path, sprites):
+    """
+    renders sprites into the [Events] of a difficulty, used by the worker processes of Mapset.write
+    :param path: .osu file
+    :param sprites: list of sprites only this difficulty shows
+    """
+    lines = [line for line in render_sprites(sprites).split('\n') if line]
+    Mapset.replace_events(path, lines)
+
+
+# Drives the storyboards of a whole mapset. Every .osu in the song folder is parsed concurrently. What all
+# difficulties share goes into one .osb through shared, what only some of them show goes into the [Events] of their
+# .osu through the storyboard of each difficulty
+class Mapset:
+    # first fields of the [Events] lines that are storyboard images, everything else (backgrounds, videos, breaks,
+    # sound samples, comments) is left where it is when the section is rewritten
+    objects = ('Sprite', 'Animation', '4', '6')
+
+    def __init__(self, song_folder, sb_folder="", seed=None, beatmap_cache=None, processes=None):
+        """
+        :param song_folder: folder of the mapset
+        :param sb_folder: folder of the storyboard images, relative to the song folder
+        :param seed: seed of the shared storyboard, each difficulty's storyboard is seeded from it and its file name
+        :param beatmap_cache: optional Cache.BeatmapCache to parse through
+        :param processes: worker processes to parse with, None uses every core and 1 parses serially
+        """
+        if song_folder[-1:] not in ('\\', '/'):
+            song_folder += '/'
+        self.song_folder = song_folder
+        self.difficulties = Mapset.discover(song_folder)
+        if not self.difficulties:
+            raise ValueError('No .osu files in the song folder', song_folder)
+
+        paths = [song_folder + name for name in self.difficulties]
+        if processes == 1 or len(paths) < 2:
+            beatmaps = [parse_difficulty(path, beatmap_cache) for path in paths]
+        else:
+            with Pool(processes) as pool:
+                beatmaps = pool.starmap(parse_difficulty, [(path, beatmap_cache) for path in paths])
+
+        # storyboard per difficulty for what only that difficulty shows
+        self.storyboards = dict()
+        for name, beatmap in zip(self.difficulties, beatmaps):
+            difficulty_seed = None if seed is None else '{}/{}'.format(seed, name)
+            self.storyboards[name] = Storyboard(song_folder, name, sb_folder, difficulty_seed, beatmap=beatmap)
+
+        # storyboard going into the .osb every difficulty loads, timed like the first difficulty
+        first = self.difficulties[0]
+        self.shared = Storyboard(song_folder, first, sb_folder, seed, beatmap=beatmaps[0])
+
+    @classmethod
+    def discover(cls, song_folder) -> list:
+        # file names of all difficulties in the folder, sorted so the order never depends on the file system
+        return sorted(name for name in os.listdir(song_folder) if name.lower().endswith('.osu'))
+
+    def storyboard(self, name) -> Storyboard:
+        """
+        :param name: file name of the difficulty or its version, e.g. 'Insane'
+        :return: the storyboard of that difficulty
+        """
+        if name in self.storyboards:
+            return self.storyboards[name]
+        for storyboard in self.storyboards.values():
+            if storyboard.beatmap.version == name:
+                return storyboard
+        raise KeyError(name)
+
+    def share(self, sprite, difficulties=None):
+        """
+        shows the same sprite on some of the difficulties without building it again for each of them. Sprites every
+        difficulty shows belong into shared instead
+        :param sprite: sprite or animation
+        :param difficulties: file names or versions of the difficulties, None means all of them
+        :return: the sprite
+        """
+        names = self.difficulties if difficulties is None else difficulties
+        for name in names:
+            self.storyboard(name).sprites.append(sprite)
+        return sprite
+
+    @classmethod
+    def replace_events(cls, path, lines):
+        """
+        swaps the storyboard objects in the [Events] of an .osu for new ones, everything else stays untouched
+        :param path: .osu file
+        :param lines: rendered storyboard lines without line breaks
+        """
+        with open(path, 'r', encoding='utf8', newline='') as file:
+            text = file.read()
+        newline = '\r\n' if '\r\n' in text else '\n'
+        source = text.splitlines()
+
+        result = list()
+        events = False      # inside of [Events]
+        inserted = False
+        skipping = False    # inside of an old storyboard object and its commands
+
+        def insert():
+            # trailing blank lines of the section stay after the new objects
+            blank = list()
+            while result and not result[-1].strip():
+                blank.append(result.pop())
+            result.extend(lines)
+            result.extend(blank)
+
+        for line in source:
+            if line.startswith('['):
+                if events and not inserted:
+                    insert()
+                    inserted = True
+                events = line.strip() == '[Events]'
+                skipping = False
+                result.append(line)
+                continue
+            if not events:
+                result.append(line)
+                continue
+
+            if line[:1] in (' ', '_'):
+                if not skipping:
+                    result.append(line)
+                continue
+            skipping = line.split(',', 1)[0].strip() in Mapset.objects
+            if skipping:
+                continue
+
+            # new objects go where osu! puts them, ahead of the sound samples
+            if line.startswith('//Storyboard Sound Samples') and not inserted:
+                result.extend(lines)
+                inserted = True
+            result.append(line)
+
+        if events and not inserted:
+            insert()
+
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+        with os.fdopen(handle, 'w', encoding='utf8', newline='') as file:
+            file.write(newline.join(result) + (newline if text.endswith(('\n', '\r')) else ''))
+        os.replace(temporary, path)
+
+    def write(self, processes=None, **to_osb):
+        """
+        writes the shared .osb once and the storyboard of every difficulty into its .osu. Difficulties without any
+        sprites of their own aren't touched, so whatever they have in their .osu stays
+        :param processes: worker processes, None uses every core and 1 writes serially
+        :param to_osb: further arguments for writing the .osb, see Storyboard.to_osb
+        """
+        self.shared.to_osb(processes=processes, **to_osb)
+
+        tasks = [(self.song_folder + name, list(self.storyboards[name].iter_sprites()))
+                 for name in self.difficulties]
+        tasks = [(path, sprites) for path, sprites in tasks if sprites]
+        if processes == 1 or len(tasks) < 2:
+            for path, sprites in tasks:
+                write_difficulty(path, sprites)
+            return
+        with Pool(processes) as pool:
+            pool.starmap(write_difficulty, tasks)
@@ -1,7 +1,12 @@
+from heapq import merge
 import Constants
+from Command import Command, CommandTable
 
 
 class SBObj:
+    # keep the rendered lines of objects around until they change, set on the class or on single objects
+    cache_renders = False
+
     def __init__(self, t, path, layer=Constants.la['bg'], origin=Constants.o['cc'], x=320, y=240):
         self.t = t
         self.layer = layer
@@ -10,48 +15,109 @@ class SBObj:
         self.x = x
         self.y = y
         self.commands = list()
+        self.table = None       # optional columnar storage for plain commands, see use_table
+
+        # render cache, anything changing the object outside of append and pluck has to call invalidate
+        self.dirty = True
+        self.rendered = None
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def use_table(self):
+        """
+        switches the object to columnar command storage, plain commands appended from now on (and the ones already
+        attached) are kept in a CommandTable instead of as separate objects. Loops and anything else the table
+        can't hold stay in self.commands
+        :return: reference to self
+        """
+        if self.table is None:
+            self.table = CommandTable()
+            commands = self.commands
+            self.commands = list()
+            for command in commands:
+                self.append(command)
+        return self
 
     def append(self, command):
-        self.commands.append(command)
+        if self.table is not None and CommandTable.accepts(command):
+            self.table.append(command)
+        else:
+            self.commands.append(command)
+        self.dirty = True
 
     def pluck(self, command):
-        self.commands.pluck(command)
-
-    def render(self, *args):
+        if self.table is not None and CommandTable.accepts(command):
+            self.table.remove(command)
+        else:
+            self.commands.remove(command)
+        self.dirty = True
+
+    def invalidate(self):
+        # drops the cached render, e.g. after changing attributes or a loop's children directly
+        self.dirty = True
+        self.rendered = None
+
+    def iter_lines(self, *args):
         """
-        renders the sprite and all children
+        lazily renders the sprite and all children line by line, or replays the cached lines if caching is enabled
+        and the object didn't change since it was last rendered
         :param args: additional arguments to be rendered
-        :return: the whole SBObject rendered
+        :return: generator of output lines without line breaks
         """
-        # start with base arguments
-        rendered_string = '{},{},{},"{}",{},{}'.format(self.t, self.layer, self.origin, self.path, self.x, self.y)
+        if not self.cache_renders:
+            yield from self.generate_lines(*args)
+            return
+
+        if not self.dirty and self.rendered is not None:
+            self.cache_hits += 1
+            yield from self.rendered
+            return
 
-        # add all other arguments at the end
-        for arg in args:
-            rendered_string += ',{}'.format(arg)
+        self.cache_misses += 1
+        self.rendered = tuple(self.generate_lines(*args))
+        self.dirty = False
+        yield from self.rendered
 
-        # new line
-        rendered_string += '\n'
+    def generate_lines(self, *args):
+        """
+        renders the sprite and all children line by line
+        :param args: additional arguments to be rendered
+        :return: generator of output lines without line breaks
+        """
+        # start with base arguments and add all other arguments at the end
+        yield ','.join(['{},{},{},"{}",{},{}'.format(self.t, self.layer, self.origin, self.path, self.x, self.y)] +
+                       ['{}'.format(arg) for arg in args])
 
         # sorting commands compares start time!
         # equality check for commands compares TYPE, so this removes duplicate commands and sorts by time
-        self.commands = sorted(set(self.commands))
+        # (dict keeps the first of each duplicate in insertion order, so ties always come out the same way)
+        self.commands = sorted(dict.fromkeys(self.commands))
+
+        # selectively decide on which command to render, skipping commands fully contained
+        # by another command of the same type
+        if self.table is None:
+            for command in Command.visible(self.commands):
+                yield from command.iter_lines()
+        else:
+            # the table renders its rows in bulk, everything else is merged in by start time
+            visible = Command.visible(self.commands)
+            loops = [command for command in visible if command.t == 'L']
+            commands = ((command.start_time, command) for command in visible)
+            for _, item in merge(self.table.iter_rendered(loops), commands, key=lambda entry: entry[0]):
+                if isinstance(item, str):
+                    yield item
+                else:
+                    yield from item.iter_lines()
+
+        # empty line after every object
+        yield ''
 
-        # selectively decide on which command to render
-        for command in self.commands:
-
-            # filter through all commands attached to the Object. Compare their typing and if
-            # another command of the same type is starting before or after it
-            matches = [comm for comm in self.commands if comm.t == command.t and
-                       comm.start_time < command.start_time and comm.end_time > command.end_time
-                       and comm is not command]
-
-            # i didnt want to switch the logic of this around so
-            # this must return no matches in order to decide a command is worth rendering
-            if len(matches) == 0:
-                rendered_string += command.render() + '\n'
-
-        return rendered_string + '\n'
+    def render(self):
+        """
+        renders the sprite and all children
+        :return: the whole SBObject rendered
+        """
+        return ''.join(line + '\n' for line in self.iter_lines())
 
 
 # Sprites are the bare minimum object and dont really do much else from their base
@@ -59,9 +125,6 @@ class Sprite(SBObj):
     def __init__(self, path, layer=Constants.la['bg'], origin=Constants.o['cc'], x=320, y=240):
         super().__init__('Sprite', path, layer, origin, x, y)
 
-    def render(self):
-        return super().render()
-
 
 # Animations don't do much more too apart from having more attributes
 class Animation(SBObj):
@@ -72,6 +135,6 @@ class Animation(SBObj):
         self.frame_delay = int(frame_delay)
         self.loop_type = str(loop_type)
 
-    def render(self):
-        return super().render(self.frame_count, self.frame_delay, self.loop_type)
+    def iter_lines(self):
+        return super().iter_lines(self.frame_count, self.frame_delay, self.loop_type)
 
@@ -0,0 +1,786 @@
+from bisect import bisect_right
+from collections import Counter
+from itertools import product, zip_longest
+from math import inf, nextafter
+import os
+import re
+import string
+import tempfile
+import Constants
+from Command import Command, CommandTable, Factory, L
+from State import StateTable
+
+
+# Shrinks the commands of sprites without changing how they animate: merges commands that continue each other,
+# drops commands that only repeat the value already being held and folds repeating blocks into loops
+class Optimizer:
+
+    def __init__(self, loops=True, max_block=32):
+        """
+        :param loops: fold repeating blocks of commands into L loops
+        :param max_block: longest block of commands that is looked for when folding
+        """
+        self.loops = loops
+        self.max_block = max_block
+
+    @classmethod
+    def plain(cls, command) -> bool:
+        # only commands with plain start and end values can be reasoned about
+        return CommandTable.accepts(command)
+
+    @classmethod
+    def constant(cls, command) -> bool:
+        start_params, end_params = command.params()
+        return start_params == end_params
+
+    @classmethod
+    def continues(cls, first, second) -> bool:
+        """
+        checks if second picks up exactly where first left off, at the same speed
+        :return: True if both can be replaced by a single command
+        """
+        if first.end_time != second.start_time or type(first) is not type(second):
+            return False
+
+        first_start, first_end = first.params()
+        second_start, second_end = second.params()
+        if first_end != second_start:
+            return False
+
+        # holding the same value, easing doesn't matter
+        if first_start == first_end and second_start == second_end:
+            return True
+
+        # two linear pieces on the same line
+        first_duration = first.end_time - first.start_time
+        second_duration = second.end_time - second.start_time
+        if first.easing != 0 or second.easing != 0 or first_duration == 0 or second_duration == 0:
+            return False
+        return all((e1 - s1) * second_duration == (e2 - s2) * first_duration
+                   for s1, e1, s2, e2 in zip(first_start, first_end, second_start, second_end))
+
+    @classmethod
+    def merge(cls, first, second):
+        easing = 0 if Optimizer.constant(first) and Optimizer.constant(second) else first.easing
+        return Factory.construct(type(first), easing, first.start_time, second.end_time,
+                                 first.params()[0], second.params()[1])
+
+    @classmethod
+    def visible_commands(cls, sbobj) -> list:
+        # exactly what the renderer would write for the object, deduplicated and sorted by start time
+        commands = list(sbobj.commands)
+        if sbobj.table is not None:
+            commands.extend(sbobj.table)
+        return Command.visible(sorted(dict.fromkeys(commands)))
+
+    @classmethod
+    def replace_commands(cls, sbobj, commands):
+        # puts new commands back the way the object stored the old ones
+        sbobj.commands = list()
+        if sbobj.table is not None:
+            sbobj.table = CommandTable()
+        for command in sorted(commands):
+            sbobj.append(command)
+        sbobj.invalidate()
+
+    def merge_and_drop(self, commands, lifetime_end):
+        """
+        walks over the commands of each type in order, merging commands that continue each other and dropping
+        constant commands that hold the value the previous command already ended on
+        :param commands: visible plain commands sorted by start time
+        :param lifetime_end: latest end time on the sprite, commands reaching it are kept so the sprite lives as long
+        :return: tuple of the remaining commands, the amount merged and the amount dropped
+        """
+        kept = list()
+        previous = dict()       # type -> index in kept of the latest command
+        latest_end = dict()     # type -> latest end time of the type so far
+        spans = dict()          # type -> list of (start, end) of every command of the type in order
+        positions = list()      # position of each command in the spans of its type
+        merged = 0
+        dropped = 0
+
+        for command in commands:
+            positions.append(len(spans.setdefault(command.t, list())))
+            spans[command.t].append((command.start_time, command.end_time))
+
+        def hides(t, position, start, end):
+            # a merged command is longer than the ones it replaces and could now strictly contain one of the later
+            # commands of its type, which would then not be rendered at all
+            others = spans[t]
+            for k in range(position + 1, len(others)):
+                later_start, later_end = others[k]
+                if later_start >= end:
+                    return False
+                if later_start > start and later_end < end:
+                    return True
+            return False
+
+        for command, position in zip(commands, positions):
+            i = previous.get(command.t)
+            # only touch commands that don't overlap anything else of their type
+            if i is not None and latest_end[command.t] == kept[i].end_time <= command.start_time:
+                last = kept[i]
+                if Optimizer.continues(last, command) and \
+                        not hides(command.t, position, last.start_time, command.end_time):
+                    kept[i] = Optimizer.merge(last, command)
+                    latest_end[command.t] = kept[i].end_time
+                    merged += 1
+                    continue
+                if Optimizer.constant(command) and last.params()[1] == command.params()[0] and \
+                        command.end_time < lifetime_end:
+                    dropped += 1
+                    continue
+
+            previous[command.t] = len(kept)
+            kept.append(command)
+            latest_end[command.t] = max(latest_end.get(command.t, command.end_time), command.end_time)
+
+        return kept, merged, dropped
+
+    def fold(self, commands):
+        """
+        replaces blocks of commands that repeat back to back at a fixed period with a loop
+        :param commands: plain commands sorted by start time
+        :return: tuple of the new command list and the amount of commands that went into loops
+        """
+        starts = [command.start_time for command in commands]
+        shapes = [(type(command), command.easing, command.end_time - command.start_time) + command.params()
+                  for command in commands]
+        folded = list()
+        count = 0
+        i = 0
+
+        while i < len(commands):
+            best = None
+            for block in range(1, min(self.max_block, (len(commands) - i) // 2) + 1):
+                period = starts[i + block] - starts[i]
+                if period <= 0:
+                    continue
+
+                # osu! repeats a loop after its children's last end, relative to the first child's start
+                if max(commands[j].end_time for j in range(i, i + block)) - starts[i] != period:
+                    continue
+
+                repeats = 1
+                while i + (repeats + 1) * block <= len(commands) and all(
+                        shapes[i + repeats * block + j] == shapes[i + j] and
+                        starts[i + repeats * block + j] - starts[i + j] == repeats * period
+                        for j in range(block)):
+                    repeats += 1
+
+                # has to save lines, a loop costs one line for itself
+                if repeats > 1 and block * (repeats - 1) > 1 and \
+                        (best is None or block * (repeats - 1) > best[0] * (best[1] - 1)):
+                    best = (block, repeats)
+
+            if best is None:
+                folded.append(commands[i])
+                i += 1
+                continue
+
+            block, repeats = best
+            loop = L(starts[i], repeats)
+            for command in commands[i:i + block]:
+                start_params, end_params = command.params()
+                loop.add(Factory.construct(type(command), command.easing, command.start_time - starts[i],
+                                           command.end_time - starts[i], start_params, end_params))
+            folded.append(loop)
+            count += block * repeats
+            i += block * repeats
+
+        return folded, count
+
+    def optimize(self, sbobj):
+        """
+        optimizes the commands of a single sprite or animation in place
+        :param sbobj: object to optimize
+        :return: dictionary reporting command counts and bytes before and after
+        """
+        before = sbobj.render()
+        commands = Optimizer.visible_commands(sbobj)
+
+        plain = [command for command in commands if Optimizer.plain(command)]
+        other = [command for command in commands if not Optimizer.plain(command)]
+        lifetime_end = max((command.end_time for command in commands), default=0)
+
+        plain, merged, dropped = self.merge_and_drop(plain, lifetime_end)
+        folded = 0
+        if self.loops:
+            plain, folded = self.fold(plain)
+
+        Optimizer.replace_commands(sbobj, plain + other)
+
+        after = sbobj.render()
+        return {'path': sbobj.path,
+                'commands_before': before.count('\n') - 2,
+                'commands_after': after.count('\n') - 2,
+                'bytes_before': len(before.encode('utf8')),
+                'bytes_after': len(after.encode('utf8')),
+                'bytes_saved': len(before.encode('utf8')) - len(after.encode('utf8')),
+                'merged': merged,
+                'dropped': dropped,
+                'folded': folded}
+
+
+# Removes what can't be seen. Sprites that are invisible (opacity, scale or a vector scale axis at 0) or off screen for
+# their whole life are dropped entirely, everything after a sprite disappears for good is cut off and commands that only
+# run while their sprite is invisible are dropped. Timelines are evaluated the same way State.StateTable samples them
+class Culler:
+    # timelines that hide a sprite while they're 0 and the command type feeding them
+    hiding = {'opacity': 'F', 'scale': 'S', 'vector_x': 'V', 'vector_y': 'V'}
+
+    # commands feeding the same timeline as another type, they can't be dropped one type at a time
+    shared = {'M': 'xy', 'MX': 'x', 'MY': 'y'}
+
+    # easings that never leave the range between their start and end value
+    contained = frozenset(range(24))
+
+    def __init__(self, margin=None, bounds=Constants.playfield):
+        """
+        :param margin: enables culling sprites that never enter the screen. The largest distance from the position of
+        a sprite to any of its pixels at scale 1 (the image diagonal is always enough), either a number or a function
+        receiving the sprite. None only culls by opacity and scale
+        :param bounds: visible area as (left, right, top, bottom)
+        """
+        self.margin = margin
+        self.bounds = bounds
+
+    @classmethod
+    def zero_intervals(cls, timeline, default) -> list:
+        """
+        finds where a timeline sits at 0
+        :param timeline: segments as StateTable.build_timelines makes them
+        :param default: value if there is no command at all
+        :return: sorted list of disjoint [start, end) pairs, open ends are infinite
+        """
+        if not timeline:
+            return [(-inf, inf)] if default == 0 else []
+
+        intervals = list()
+
+        def add(start, end):
+            if intervals and intervals[-1][1] >= start:
+                intervals[-1] = (intervals[-1][0], max(intervals[-1][1], end))
+            else:
+                intervals.append((start, end))
+
+        # before the first command its start value applies
+        if timeline[0][3] == 0:
+            add(-inf, timeline[0][0])
+
+        for j, (start, end, easing, start_value, end_value) in enumerate(timeline):
+            # each segment decides the value until the next one starts, then its end value is held
+            following = timeline[j + 1][0] if j + 1 < len(timeline) else inf
+            if start == following:
+                continue
+            if start_value == 0 and end_value == 0:
+                add(start, min(end, following))
+            if end < following and end_value == 0:
+                add(end, following)
+        return intervals
+
+    @classmethod
+    def union(cls, intervals) -> list:
+        # merges overlapping and touching intervals
+        merged = list()
+        for start, end in sorted(intervals):
+            if merged and merged[-1][1] >= start:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        return merged
+
+    @classmethod
+    def invisible(cls, sbobj, commands) -> list:
+        """
+        :param sbobj: sprite or animation
+        :param commands: plain commands of the object, loops expanded
+        :return: sorted disjoint [start, end) intervals the object can't be seen in, including before it's born and
+        after it dies
+        """
+        if not commands:
+            return [(-inf, inf)]
+        timelines = StateTable.build_timelines(commands)
+        # the object is still there at the very moment its last command ends
+        intervals = [(-inf, min(command.start_time for command in commands)),
+                     (nextafter(max(command.end_time for command in commands), inf), inf)]
+        for name in Culler.hiding:
+            intervals.extend(Culler.zero_intervals(timelines.get(name), StateTable.defaults[name]))
+        return Culler.union(intervals)
+
+    @classmethod
+    def extent(cls, timeline, default):
+        """
+        :return: lowest and highest value a timeline ever takes or None if an easing overshoots its ends
+        """
+        if not timeline:
+            return default, default
+        if any(segment[2] not in Culler.contained for segment in timeline):
+            return None
+        values = [value for segment in timeline for value in segment[3:]]
+        return min(values), max(values)
+
+    def off_screen(self, sbobj, commands) -> bool:
+        """
+        checks if the object stays outside of the visible area on one side for its whole life
+        :param sbobj: sprite or animation
+        :param commands: plain commands of the object, loops expanded
+        """
+        if self.margin is None:
+            return False
+        margin = self.margin(sbobj) if callable(self.margin) else self.margin
+        timelines = StateTable.build_timelines(commands)
+
+        extents = [Culler.extent(timelines.get(name), default) for name, default in
+                   (('x', float(sbobj.x)), ('y', float(sbobj.y)), ('scale', 1.0),
+                    ('vector_x', 1.0), ('vector_y', 1.0))]
+        if None in extents:
+            return False
+        (left, right), (top, bottom), scale, vector_x, vector_y = extents
+
+        # the furthest any pixel can get from the position of the sprite, whatever its rotation
+        reach = margin * scale[1] * max(vector_x[1], vector_y[1])
+        return right < self.bounds[0] - reach or left > self.bounds[1] + reach or \
+            bottom < self.bounds[2] - reach or top > self.bounds[3] + reach
+
+    @classmethod
+    def truncate(cls, command, time):
+        """
+        cuts a linear command short, the shortened command ends on the value the original had at time
+        :return: the shortened command or None if its values at time can't be stored exactly
+        """
+        if command.easing != 0 or not Optimizer.plain(command):
+            return None
+        clean = CommandTable.spec[command.t][1]
+        progress = (time - command.start_time) / (command.end_time - command.start_time)
+        start_params, end_params = command.params()
+        values = list()
+        for start_value, end_value in zip(start_params, end_params):
+            value = start_value + (end_value - start_value) * progress
+            if clean(value) != value:
+                return None
+            values.append(int(value) if float(value).is_integer() else value)
+        return Factory.construct(type(command), 0, command.start_time, time, start_params, values)
+
+    @classmethod
+    def cut(cls, commands, time):
+        """
+        ends the object at time, everything after it has to be invisible already. The cut moves later while a
+        command that can't be shortened runs over it
+        :param commands: visible plain commands sorted by start time
+        :param time: start of the invisible stretch lasting until the end
+        :return: tuple of the new commands, the amount dropped and the amount shortened
+        """
+        while True:
+            running = [command for command in commands if command.start_time < time < command.end_time and
+                       Culler.truncate(command, time) is None]
+            if not running:
+                break
+            time = max(command.end_time for command in running)
+
+        # nothing reaching the cut would make the object die early, cut when the next command starts instead
+        if not any(command.start_time < time <= command.end_time for command in commands):
+            time = min((command.start_time for command in commands if command.start_time >= time), default=inf)
+        if time >= max(command.end_time for command in commands):
+            return commands, 0, 0
+
+        kept = list()
+        held = dict()       # type -> command whose start values are held at the cut
+        dropped = 0
+        truncated = 0
+        for command in commands:
+            if command.end_time <= time:
+                kept.append(command)
+            elif command.start_time < time:
+                kept.append(Culler.truncate(command, time))
+                truncated += 1
+            elif command.start_time == time or command.t not in held:
+                # the first command of a type decides its value before it starts, and whatever starts right at the
+                # cut decides it at the cut
+                if command.t in held:
+                    dropped += 1
+                held[command.t] = command
+                continue
+            else:
+                dropped += 1
+            held.setdefault(command.t, None)
+
+        for command in held.values():
+            if command is not None:
+                start_params = command.params()[0]
+                kept.append(Factory.construct(type(command), 0, time, time, start_params, start_params))
+                truncated += 1
+        return sorted(kept), dropped, truncated
+
+    @classmethod
+    def drop_hidden(cls, commands, invisible):
+        """
+        drops commands that start and end while the object is invisible, if another command of their type takes
+        over before it can be seen again. Commands feeding the invisibility itself are always kept
+        :param commands: visible plain commands sorted by start time
+        :param invisible: intervals as Culler.invisible finds them
+        :return: tuple of the remaining commands and the amount dropped
+        """
+        born = min(command.start_time for command in commands)
+        starts = [start for start, _ in invisible]
+        hiding = set(Culler.hiding.values())
+        moving = {command.t for command in commands if command.t in Culler.shared}
+
+        by_type = dict()
+        for i, command in enumerate(commands):
+            by_type.setdefault(command.t, list()).append(i)
+
+        dropped = set()
+        for t, indices in by_type.items():
+            if t in hiding or (t in Culler.shared and len(moving) > 1):
+                continue
+            for position, i in enumerate(indices):
+                command = commands[i]
+                start, end = invisible[bisect_right(starts, command.start_time) - 1]
+                if end <= command.end_time or end == inf:
+                    continue
+                # the next command of the type has to start before the object shows up again
+                if position + 1 == len(indices) or commands[indices[position + 1]].start_time > end:
+                    continue
+                # the first one decides the value from the moment the object is born
+                if position == 0 and start > born:
+                    continue
+                dropped.add(i)
+
+        return [command for i, command in enumerate(commands) if i not in dropped], len(dropped)
+
+    def cull(self, sbobj):
+        """
+        culls a single sprite or animation in place
+        :param sbobj: object to cull
+        :return: dictionary reporting what was removed, removed is 'invisible' or 'off_screen' if the whole object
+        can go and None otherwise
+        """
+        before = sbobj.render()
+        report = {'path': sbobj.path, 'removed': None, 'dropped': 0, 'truncated': 0,
+                  'bytes_before': len(before.encode('utf8')), 'bytes_after': 0}
+
+        commands = Optimizer.visible_commands(sbobj)
+        expanded = StateTable.commands(sbobj)
+        invisible = Culler.invisible(sbobj, expanded)
+        if invisible == [(-inf, inf)]:
+            report['removed'] = 'invisible'
+        elif self.off_screen(sbobj, expanded):
+            report['removed'] = 'off_screen'
+        if report['removed'] is not None:
+            report['dropped'] = len(commands)
+            return report
+
+        # loops repeat their children, leave objects with them alone. The same goes for anything else not plain
+        if all(Optimizer.plain(command) for command in commands):
+            commands, dropped, truncated = Culler.cut(commands, invisible[-1][0])
+            commands, hidden = Culler.drop_hidden(commands, invisible)
+            if dropped + truncated + hidden:
+                Optimizer.replace_commands(sbobj, commands)
+                report['dropped'] = dropped + hidden
+                report['truncated'] = truncated
+
+        report['bytes_after'] = len(sbobj.render().encode('utf8'))
+        return report
+
+
+# Packs the commands of sprites that show the same image one after another onto a single sprite, so the client
+# has fewer objects to load. A sprite can take over the commands of a later one when nothing would look different:
+# it's the same kind of sprite animating the same properties, it's gone invisible before the later one starts and
+# the later one picks up each property where it was left off. Taking over also moves the later sprite down in draw
+# order, so no other sprite of the layer alive at the same time may sit in between
+class Pooler:
+
+    def __init__(self, window=1024):
+        """
+        :param window: how many sprites back a sprite may be moved in draw order, bounds the work per sprite
+        """
+        self.window = window
+
+    @classmethod
+    def profile(cls, sbobj):
+        """
+        everything the pooling decisions need to know about one sprite
+        :return: dictionary or None if the sprite can't be pooled (animations, loops and anything else not plain)
+        """
+        if sbobj.t != 'Sprite':
+            return None
+        commands = Optimizer.visible_commands(sbobj)
+        if not commands or not all(Optimizer.plain(command) for command in commands):
+            return None
+
+        timelines = StateTable.build_timelines(commands)
+        dies = max(command.end_time for command in commands)
+
+        # whatever the sprite is left with has to keep it invisible until the next one takes over
+        hidden = False
+        for name in Culler.hiding:
+            intervals = Culler.zero_intervals(timelines.get(name), StateTable.defaults[name])
+            if name in timelines and intervals and intervals[-1][1] == inf and intervals[-1][0] <= dies:
+                hidden = True
+
+        # the header position only matters for axes no command moves
+        key = (sbobj.path, sbobj.layer, sbobj.origin, None if 'x' in timelines else sbobj.x,
+               None if 'y' in timelines else sbobj.y, frozenset(timelines))
+        return {'commands': commands,
+                'born': min(command.start_time for command in commands),
+                'dies': dies,
+                'first': {name: (timeline[0][0], timeline[0][3]) for name, timeline in timelines.items()},
+                'held': {name: timeline[-1][4] for name, timeline in timelines.items()},
+                'hidden': hidden,
+                'key': key}
+
+    @classmethod
+    def continues(cls, last, profile) -> bool:
+        """
+        checks if a sprite can take over the commands of another one
+        :param last: profile of the sprite that showed the image so far
+        :param profile: profile of the sprite that would be taken over
+        """
+        if not last['hidden'] or last['dies'] >= profile['born']:
+            return False
+        # until the later sprite sets a property itself the value the earlier one ended on is what shows
+        return all(start == profile['born'] or last['held'][name] == value
+                   for name, (start, value) in profile['first'].items())
+
+    def pool(self, sprites):
+        """
+        merges sprites in place
+        :param sprites: sprites in render order
+        :return: tuple of the set of ids of the sprites that were taken over and the amount of sprites that took over
+        at least one other
+        """
+        chains = dict()         # key -> list of [head position, head sprite, profile of the last sprite taken over]
+        layers = dict()         # layer -> list of (position, born, dies) of every sprite seen so far
+        removed = set()
+        heads = set()
+
+        for position, sprite in enumerate(sprites):
+            profile = Pooler.profile(sprite)
+            if profile is None:
+                commands = StateTable.commands(sprite)
+                if not commands:
+                    continue
+                born = min(command.start_time for command in commands)
+                dies = max(command.end_time for command in commands)
+            else:
+                born, dies = profile['born'], profile['dies']
+            seen = layers.setdefault(sprite.layer, list())
+
+            if profile is not None:
+                # the latest sprite of the layer overlapping this one in time, it can't be skipped over in draw order
+                barrier = position - self.window - 1
+                for other, other_born, other_dies in reversed(seen):
+                    if other <= barrier:
+                        break
+                    if other_born <= dies and other_dies >= born:
+                        barrier = other
+                        break
+
+                candidates = chains.setdefault(profile['key'], list())
+                candidates[:] = [chain for chain in candidates if chain[0] > position - self.window]
+                best = None
+                for chain in candidates:
+                    if chain[0] > barrier and Pooler.continues(chain[2], profile) and \
+                            (best is None or chain[2]['dies'] > best[2]['dies']):
+                        best = chain
+
+                if best is None:
+                    candidates.append([position, sprite, profile])
+                else:
+                    for command in profile['commands']:
+                        best[1].append(command)
+                    best[1].invalidate()
+                    best[2] = profile
+                    removed.add(id(sprite))
+                    heads.add(id(best[1]))
+
+            seen.append((position, born, dies))
+
+        return removed, len(heads)
+
+
+# Shortens the text of a written .osb with osu!'s [Variables]: strings the file repeats a lot (sprite paths, whole
+# object headers, parameter tails of commands, single fields) are defined once as $names and every use is replaced
+# by the name. Only whole comma separated fields or tails of them are replaced and never the first field of a line,
+# so indentation and command types stay readable to the client. Names all have the same length and values never
+# contain a $, so replacing the names back in any order restores the file exactly
+class Compactor:
+    alphabet = string.ascii_letters
+
+    def __init__(self, length=2, limit=None, budget=1 << 20):
+        """
+        :param length: characters per name after the $
+        :param limit: most variables to define, defaults to as many as there are names
+        :param budget: distinct strings counted at once, strings only seen once so far are forgotten beyond it so
+        unique parameters of huge files don't fill the memory
+        """
+        self.length = length
+        self.limit = len(Compactor.alphabet) ** length if limit is None else limit
+        self.budget = budget
+
+    @classmethod
+    def tail_start(cls, line) -> int:
+        # object headers can repeat from the layer on, commands only from their parameters on as the times before
+        # them hardly ever repeat
+        return 4 if line[:1] in (' ', '_') else 1
+
+    @classmethod
+    def skipped(cls, line) -> bool:
+        return not line or line.startswith(('[', '//'))
+
+    def candidates(self, line):
+        """
+        :param line: rendered line
+        :return: generator of the substrings of the line that could be replaced by a name
+        """
+        if Compactor.skipped(line):
+            return
+        fields = line.split(',')
+        shortest = self.length + 2
+        for i in range(Compactor.tail_start(line), len(fields) - 1):
+            tail = ','.join(fields[i:])
+            if len(tail) >= shortest:
+                yield tail
+        for field in fields[1:]:
+            if len(field) >= shortest:
+                yield field
+
+    @classmethod
+    def substitute(cls, line, variables) -> str:
+        """
+        :param line: rendered line
+        :param variables: dictionary of value -> $name
+        :return: the line with the longest replaceable tail and every other replaceable field swapped for names
+        """
+        if Compactor.skipped(line) or not variables:
+            return line
+        fields = line.split(',')
+        start = Compactor.tail_start(line)
+        result = [fields[0]]
+        for i in range(1, len(fields)):
+            if i >= start:
+                name = variables.get(','.join(fields[i:]))
+                if name is not None:
+                    result.append(name)
+                    break
+            result.append(variables.get(fields[i], fields[i]))
+        return ','.join(result)
+
+    @classmethod
+    def expand(cls, line, pattern, definitions) -> str:
+        """
+        undoes substitute. osu! replaces the names one after another, with names of one length and no $ in the
+        values that comes down to looking up every name in the line once
+        :param line: compacted line
+        :param pattern: compiled expression matching a name
+        :param definitions: dictionary of $name -> value from the [Variables] section
+        """
+        if '$' not in line:
+            return line
+        return pattern.sub(lambda match: definitions.get(match.group(), match.group()), line)
+
+    def names(self):
+        for letters in product(Compactor.alphabet, repeat=self.length):
+            yield '$' + ''.join(letters)
+
+    def profit(self, value, uses) -> int:
+        # characters saved by the uses minus the '$name=value' line defining it
+        return uses * (len(value) - self.length - 1) - (self.length + len(value) + 3)
+
+    def select(self, path) -> dict:
+        """
+        picks the variables for a file in two passes: the most profitable strings by how often they appear, then
+        only those that still pay off once tails took over the fields in them
+        :param path: plain .osb
+        :return: dictionary of value -> $name
+        """
+        counts = Counter()
+        with open(path, encoding='utf8') as file:
+            for line in file:
+                counts.update(self.candidates(line.rstrip('\n')))
+                if len(counts) > self.budget:
+                    counts = Counter({value: uses for value, uses in counts.items() if uses > 1})
+        ranked = sorted((value for value, uses in counts.items() if self.profit(value, uses) > 0),
+                        key=lambda value: -self.profit(value, counts[value]))[:self.limit]
+        variables = dict(zip(ranked, self.names()))
+        del counts
+
+        values = {name: value for value, name in variables.items()}
+        uses = Counter()
+        with open(path, encoding='utf8') as file:
+            for line in file:
+                uses.update(field for field in Compactor.substitute(line.rstrip('\n'), variables).split(',')
+                            if field in values)
+        kept = sorted((values[name] for name in uses if self.profit(values[name], uses[name]) > 0),
+                      key=lambda value: -self.profit(value, uses[variables[value]]))
+        return dict(zip(kept, self.names()))
+
+    def compact(self, path, verify=False) -> dict:
+        """
+        rewrites a plain .osb with a [Variables] section in place
+        :param path: .osb without variables
+        :param verify: expand the result again and compare it with the original line by line before replacing it,
+        raises ValueError if they differ
+        :return: dictionary with the amount of variables and the size of the file before and after. aborted tells why
+        the file was left as it was: 'variables' if it already uses $ and 'unprofitable' if nothing pays off
+        """
+        before = os.path.getsize(path)
+        report = {'variables': 0, 'bytes_before': before, 'bytes_after': before, 'bytes_saved': 0, 'aborted': None,
+                  'verified': False}
+
+        with open(path, encoding='utf8') as file:
+            if any('$' in line for line in file):
+                report['aborted'] = 'variables'
+                return report
+        variables = self.select(path)
+        if not variables:
+            report['aborted'] = 'unprofitable'
+            return report
+
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'w', encoding='utf8') as output, open(path, encoding='utf8') as file:
+                output.write('[Variables]\n')
+                output.write(''.join('{}={}\n'.format(name, value) for value, name in variables.items()))
+                output.write('\n')
+                for line in file:
+                    output.write(Compactor.substitute(line.rstrip('\n'), variables) + '\n')
+
+            if verify:
+                Compactor.verify(temporary, path)
+                report['verified'] = True
+            os.replace(temporary, path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+        after = os.path.getsize(path)
+        report.update({'variables': len(variables), 'bytes_after': after, 'bytes_saved': before - after})
+        return report
+
+    @classmethod
+    def verify(cls, compacted, original):
+        """
+        expands a compacted file and compares it with the original
+        :param compacted: file written by compact
+        :param original: the plain file it was made from
+        """
+        definitions = dict()
+        with open(compacted, encoding='utf8') as file:
+            for line in file:
+                line = line.rstrip('\n')
+                if line == '[Variables]':
+                    continue
+                if not line:
+                    break
+                name, _, value = line.partition('=')
+                definitions[name] = value
+            length = len(next(iter(definitions), '$')) - 1
+            pattern = re.compile(r'\$[{}]{{{}}}'.format(Compactor.alphabet, length))
+
+            with open(original, encoding='utf8') as source:
+                for number, (line, expected) in enumerate(zip_longest(file, source), 1):
+                    line = Compactor.expand((line or '').rstrip('\n'), pattern, definitions)
+                    if expected is None or line != expected.rstrip('\n'):
+                        raise ValueError('The compacted .osb doesn\'t expand back to the original', number, line)
@@ -0,0 +1,528 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from math import inf
+import mmap
+import re
+import Object
+from Command import CommandTable, F, M, MX, MY, S, V, R, C, P, L
+
+
+# Reads existing .osb files (or the [Events] of an .osu) back into sprites and commands. The file is memory-mapped
+# and walked line by line, objects are built as they come by so huge storyboards never need to fit in memory as text
+class OsbParser:
+    # command type -> (values per end, class)
+    commands = {'F': (1, F), 'S': (1, S), 'R': (1, R), 'MX': (1, MX), 'MY': (1, MY), 'M': (2, M), 'V': (2, V),
+                'C': (3, C), 'P': (1, P)}
+    # type as it appears in the file -> (values per end, class, conversion of a value, range the table holds values
+    # in, fields of a line with both ends written out, position in CommandTable.type_names, padding of each end to
+    # the table's stride) for the plain commands. Lines like that skip parse_rows, whole number types only take
+    # values written as whole numbers there
+    plain = {t.encode('utf8'): (count, cls, CommandTable.spec[t][2], bounds, 4 + 2 * count, CommandTable.type_ids[t],
+                                [0.0] * (3 - count))
+             for (t, (count, cls)), bounds in zip(commands.items(), ((0.0, 1.0), (0.0, inf), None, None, None, None,
+                                                                     (0.0, inf), (0, 255), None))
+             if t in CommandTable.spec}
+    block_size = 1 << 20        # bytes of the file split into lines at once
+
+    def __init__(self, path):
+        self.path = path
+        self.variables = dict()     # $name -> value from [Variables]
+        self.skipped = 0            # lines that didn't make sense or aren't supported (triggers, samples, videos)
+
+    def iter_lines(self):
+        """
+        memory-maps the file and walks over the lines of the [Events] section, variables already substituted
+        :return: generator of raw lines as bytes without line breaks
+        """
+        with open(self.path, 'rb') as file:
+            # mmap can't map empty files
+            if file.seek(0, 2) == 0:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                section = b'[Events]'
+                events = True
+                replacements = list()
+
+                for line in OsbParser.split_lines(mapped):
+                    if line[:1] == b'[':
+                        section = line.strip()
+                        events = section == b'[Events]'
+                        continue
+                    if not line.strip() or line.startswith(b'//'):
+                        continue
+
+                    if events:
+                        if replacements and b'$' in line:
+                            for name, value in replacements:
+                                line = line.replace(name, value)
+                        yield line
+                    elif section == b'[Variables]':
+                        name, _, value = line.partition(b'=')
+                        self.variables[name.strip().decode('utf8')] = value.strip().decode('utf8')
+                        # longest names first so $a can't eat into $ab
+                        replacements = sorted(((name.encode('utf8'), value.encode('utf8'))
+                                               for name, value in self.variables.items()),
+                                              key=lambda item: -len(item[0]))
+
+    @classmethod
+    def split_lines(cls, mapped):
+        """
+        cuts the mapped file into lines a large block at a time, which is a lot cheaper than reading every line on
+        its own while only a block is ever copied out of the mapping
+        :param mapped: mmap of the file
+        :return: generator of lines as bytes without line breaks
+        """
+        rest = b''
+        first = True
+        for position in range(0, len(mapped), OsbParser.block_size):
+            lines = (rest + mapped[position:position + OsbParser.block_size]).split(b'\n')
+            rest = lines.pop()
+            if first and lines and lines[0].startswith(b'\xef\xbb\xbf'):
+                lines[0] = lines[0][3:]
+            first = False
+            for line in lines:
+                yield line.rstrip(b'\r')
+        if rest:
+            yield rest[3:].rstrip(b'\r') if first and rest.startswith(b'\xef\xbb\xbf') else rest.rstrip(b'\r')
+
+    @classmethod
+    def depth(cls, line) -> int:
+        # nesting is expressed by leading spaces or underscores
+        return len(line) - len(line.lstrip(b' _'))
+
+    @classmethod
+    def number(cls, value):
+        # keeps integers integers, so coordinates come back out exactly how they went in
+        number = float(value)
+        return int(number) if number.is_integer() and b'.' not in value else number
+
+    @classmethod
+    def time(cls, value) -> int:
+        return int(round(float(value)))
+
+    @classmethod
+    def parse_object(cls, fields):
+        """
+        builds a sprite or animation out of the fields of its line
+        :param fields: split line as bytes
+        :return: object without commands or None if the line isn't one
+        """
+        kind = fields[0].decode('utf8')
+        layer = fields[1].decode('utf8')
+        origin = fields[2].decode('utf8')
+        path = fields[3].decode('utf8').strip('"')
+        x = OsbParser.number(fields[4]) if len(fields) > 4 else 320
+        y = OsbParser.number(fields[5]) if len(fields) > 5 else 240
+
+        if kind == 'Sprite':
+            return Object.Sprite(path, layer, origin, x, y)
+        if kind == 'Animation' and len(fields) > 7:
+            loop_type = fields[8].decode('utf8') if len(fields) > 8 else 'LoopForever'
+            return Object.Animation(path, layer, origin, float(fields[6]), float(fields[7]), loop_type, x, y)
+        return None
+
+    @classmethod
+    def parse_rows(cls, fields):
+        """
+        reads the commands of a single line, including osu!'s shorthands: an empty end time lasts no time,
+        a single set of values is held and more than two sets chain into consecutive commands
+        :param fields: split line as bytes, indentation already stripped
+        :return: list of (type, easing, start, end, start values, end values) tuples, empty if the line isn't a
+        command this library knows. Loops come back as (L, start, loop count)
+        """
+        t = fields[0].decode('utf8')
+        if t == 'L':
+            return [('L', OsbParser.time(fields[1]), int(fields[2]))]
+        if t not in OsbParser.commands or len(fields) < 5:
+            return []
+
+        count = OsbParser.commands[t][0]
+        easing = int(fields[1])
+        start = OsbParser.time(fields[2])
+        end = OsbParser.time(fields[3]) if fields[3] else start
+
+        if t == 'P':
+            return [(t, easing, start, end, (fields[4].decode('utf8'),), ())]
+
+        values = [float(value) for value in fields[4:]]
+        if len(values) < 2 * count:
+            values = values[:count] * 2
+        duration = end - start
+
+        return [(t, easing, start + segment * duration, end + segment * duration,
+                 values[segment * count:(segment + 1) * count], values[(segment + 1) * count:(segment + 2) * count])
+                for segment in range(len(values) // count - 1)]
+
+    @classmethod
+    def build(cls, row):
+        # turns a row of parse_rows into a command
+        if row[0] == 'L':
+            return L(row[1], row[2])
+        t, easing, start, end, start_values, end_values = row
+        subclass = OsbParser.commands[t][1]
+        if subclass is C:
+            return C(easing, start, end, start_values, end_values)
+        return subclass(easing, start, end, *start_values, *end_values)
+
+    @classmethod
+    def parse_command(cls, fields):
+        """
+        builds the commands of a single line, see parse_rows
+        :param fields: split line as bytes, indentation already stripped
+        :return: list of commands
+        """
+        return [OsbParser.build(row) for row in OsbParser.parse_rows(fields)]
+
+    def iter_objects(self, filter=None, table=False):
+        """
+        streams sprites and animations out of the file
+        :param filter: optional function receiving each object before its commands are read, objects it
+        returns False for are skipped without parsing any of their commands
+        :param table: store the commands of each object in a CommandTable instead of separate objects
+        :return: generator of finished objects
+        """
+        current = None      # object commands are currently read into, None while skipping
+        loop = None         # loop depth 2 commands are read into, None inside of triggers
+        rows = None         # columns of the plain rows of the current object, written into its table at once
+        plain_types = OsbParser.plain
+
+        def finish(sbobj):
+            if rows is not None and rows[0]:
+                sbobj.table.extend_rows(*rows)
+                for column in rows:
+                    column.clear()
+            return sbobj
+
+        for line in self.iter_lines():
+            depth = len(line) - len(line.lstrip(b' _'))
+
+            if depth == 0:
+                loop = None
+                if current is not None:
+                    yield finish(current)
+                    current = None
+                fields = line.split(b',')
+                if fields[0] in (b'Sprite', b'Animation') and len(fields) > 3:
+                    sbobj = OsbParser.parse_object(fields)
+                    if sbobj is not None and (filter is None or filter(sbobj)):
+                        current = sbobj.use_table() if table else sbobj
+                        rows = (list(), list(), list(), list(), list()) if table else None
+                else:
+                    self.skipped += 1
+                continue
+
+            # commands of filtered out objects never get looked at
+            if current is None:
+                continue
+
+            # every new depth 1 line ends the loop before it, triggers and other unsupported lines included
+            if depth == 1:
+                loop = None
+
+            fields = line[depth:].split(b',')
+            # fast path for plain commands written out the long way, which is nearly every line
+            plain = plain_types.get(fields[0])
+            if plain is not None and len(fields) == plain[4] and (depth == 1 or loop is not None):
+                count, subclass, convert, bounds, _, type_id, padding = plain
+                try:
+                    easing = int(fields[1])
+                    start = int(fields[2])
+                    end = int(fields[3])
+                    values = list(map(convert, fields[4:]))
+                except ValueError:
+                    easing = None
+                if easing is not None and start <= end:
+                    if depth == 1 and rows is not None:
+                        # out of range values get cleaned up the way the table would do it itself
+                        if bounds is not None and (min(values) < bounds[0] or max(values) > bounds[1]):
+                            clean = CommandTable.spec[subclass.__name__][1]
+                            values = [clean(value) for value in values]
+                        rows[0].append(type_id)
+                        rows[1].append(easing)
+                        rows[2].append(start)
+                        rows[3].append(end)
+                        rows[4].extend(values[:count] + padding + values[count:] + padding
+                                       if padding else values)
+                        continue
+                    if subclass is C:
+                        command = C(easing, start, end, values[:3], values[3:])
+                    else:
+                        command = subclass(easing, start, end, *values)
+                    if depth == 1:
+                        current.commands.append(command)
+                    else:
+                        loop.add(command)
+                    continue
+
+            parsed = OsbParser.parse_rows(fields)
+            if not parsed or (depth > 1 and loop is None):
+                self.skipped += 1
+                continue
+
+            if depth == 1:
+                for row in parsed:
+                    # plain commands go straight into the table without becoming objects first
+                    if table and row[0] in CommandTable.spec:
+                        # rows before it go in first so ties keep the order of the file
+                        finish(current).table.add(*row)
+                        continue
+                    command = OsbParser.build(row)
+                    current.append(command)
+                    if isinstance(command, L):
+                        loop = command
+            else:
+                for row in parsed:
+                    loop.add(OsbParser.build(row))
+
+        if current is not None:
+            yield finish(current)
+
+    def load(self, filter=None, table=False) -> list:
+        """
+        reads all objects of the file at once
+        :param filter: see iter_objects
+        :param table: see iter_objects
+        :return: list of sprites and animations
+        """
+        return list(self.iter_objects(filter, table))
+
+
+# Everything of a difficulty that effects sync to, in flat sorted columns: all timing points (inherited ones included)
+# and all hit objects. Lookups by time bisect the columns instead of walking them
+class Beatmap:
+    # every column, in the order they're stored by Cache.BeatmapCache
+    columns = ('offsets', 'beat_lengths', 'meters', 'sample_sets', 'sample_indices', 'volumes', 'uninherited',
+               'effects', 'bases', 'times', 'end_times', 'xs', 'ys', 'types', 'hitsounds')
+
+    def __init__(self):
+        self.metadata = dict()          # section -> key -> value of the key: value sections, e.g. Metadata -> Version
+
+        # timing points, sorted by offset, points on the same offset stay in file order
+        self.offsets = array('d')
+        self.beat_lengths = array('d')  # ms per beat, or the negative inverse slider velocity percentage if inherited
+        self.meters = array('H')
+        self.sample_sets = array('B')
+        self.sample_indices = array('H')
+        self.volumes = array('B')
+        self.uninherited = array('B')
+        self.effects = array('B')       # bit flags, 1 is kiai
+        self.bases = array('i')         # per point the index of the uninherited point its beat length comes from
+
+        # hit objects, sorted by time
+        self.times = array('i')
+        self.end_times = array('i')     # same as the start for circles, when sliders, spinners and holds are over
+        self.xs = array('h')
+        self.ys = array('h')
+        self.types = array('B')         # bit flags, 1 circle, 2 slider, 4 new combo, 8 spinner, 128 hold
+        self.hitsounds = array('B')
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def version(self) -> str:
+        return self.metadata.get('Metadata', {}).get('Version', '')
+
+    def value(self, section, key, default=None):
+        return self.metadata.get(section, {}).get(key, default)
+
+    def timing_points(self) -> dict:
+        """
+        :return: the uninherited timing points in the dictionary format Storyboard.timing_points and
+        Timing.TimingMap use
+        """
+        points = dict()
+        for i in range(len(self.offsets)):
+            if not self.uninherited[i]:
+                continue
+            beat_length = self.beat_lengths[i]
+            points[len(points)] = {'offset': int(round(self.offsets[i])),
+                                   'ms': beat_length,
+                                   'bpm': round(60000 / beat_length, 3) if beat_length else 0.0,
+                                   'meter': self.meters[i],
+                                   'sample': self.sample_sets[i],
+                                   'sindex': self.sample_indices[i],
+                                   'vol': self.volumes[i],
+                                   'inherit': self.uninherited[i],
+                                   'kiai': self.effects[i]}
+        return points
+
+    def point_index_at(self, time) -> int:
+        # last timing point of any kind starting at or before time, -1 if there is none
+        return bisect_right(self.offsets, time) - 1
+
+    def points_between(self, start_time, end_time) -> range:
+        """
+        :return: indices of all timing points starting in [start_time, end_time]
+        """
+        return range(bisect_left(self.offsets, start_time), bisect_right(self.offsets, end_time))
+
+    def index_bases(self):
+        # fills bases once the timing point columns are complete, points before the first uninherited one use it
+        self.bases = array('i', [0] * len(self.offsets))
+        base = next((i for i, uninherited in enumerate(self.uninherited) if uninherited), -1)
+        for i, uninherited in enumerate(self.uninherited):
+            if uninherited:
+                base = i
+            self.bases[i] = base
+
+    def beat_length_at(self, time) -> float:
+        # ms per beat of the uninherited point in effect, the first one also covers everything before it
+        if not self.bases or self.bases[0] < 0:
+            return 0.0
+        return self.beat_lengths[self.bases[max(self.point_index_at(time), 0)]]
+
+    def slider_velocity_at(self, time) -> float:
+        """
+        :return: slider velocity multiplier at time, inherited points set it and uninherited ones reset it to 1
+        """
+        i = self.point_index_at(time)
+        if i < 0 or self.uninherited[i] or self.beat_lengths[i] >= 0:
+            return 1.0
+        return min(max(-100 / self.beat_lengths[i], .1), 10.0)
+
+    def kiai_at(self, time) -> bool:
+        i = self.point_index_at(time)
+        return i >= 0 and bool(self.effects[i] & 1)
+
+    def kiai_ranges(self) -> list:
+        """
+        :return: list of (start, end) times kiai is on for, the last one ends at the last hit object
+        """
+        ranges = list()
+        start = None
+        for i in range(len(self.offsets)):
+            kiai = bool(self.effects[i] & 1)
+            if kiai and start is None:
+                start = self.offsets[i]
+            elif not kiai and start is not None:
+                ranges.append((start, self.offsets[i]))
+                start = None
+        if start is not None:
+            ranges.append((start, max(float(self.end_times[-1]) if len(self) else start, start)))
+        return ranges
+
+    def objects_between(self, start_time, end_time) -> range:
+        """
+        :return: indices of all hit objects starting in [start_time, end_time]
+        """
+        return range(bisect_left(self.times, start_time), bisect_right(self.times, end_time))
+
+    def hit_object(self, i) -> dict:
+        return {'x': self.xs[i], 'y': self.ys[i], 'time': self.times[i], 'end_time': self.end_times[i],
+                'type': self.types[i], 'hitsound': self.hitsounds[i], 'new_combo': bool(self.types[i] & 4)}
+
+
+# Reads a whole .osu. The section headers are found once, afterwards every section is parsed straight out of its
+# slice of the file without looking at any other line
+class OsuParser:
+    header = re.compile(rb'^\[(\w+)\][ \t]*\r?$', re.MULTILINE)
+    key_value_sections = ('General', 'Editor', 'Metadata', 'Difficulty')
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self.data = file.read()
+        if self.data.startswith(b'\xef\xbb\xbf'):
+            self.data = self.data[3:]
+
+        # section name -> (start, end) byte offsets of its body
+        self.sections = dict()
+        matches = list(OsuParser.header.finditer(self.data))
+        for i, match in enumerate(matches):
+            end = matches[i + 1].start() if i + 1 < len(matches) else len(self.data)
+            self.sections[match.group(1).decode('utf8')] = (match.end(), end)
+
+    def lines(self, section):
+        """
+        :param section: name of the section without brackets
+        :return: list of the non-empty, non-comment lines of the section as bytes
+        """
+        if section not in self.sections:
+            return []
+        start, end = self.sections[section]
+        return [line for line in self.data[start:end].splitlines()
+                if line.strip() and not line.startswith(b'//')]
+
+    def key_values(self, section) -> dict:
+        values = dict()
+        for line in self.lines(section):
+            key, _, value = line.partition(b':')
+            values[key.strip().decode('utf8')] = value.strip().decode('utf8')
+        return values
+
+    @classmethod
+    def timing_point(cls, fields):
+        """
+        :param fields: split line as bytes
+        :return: tuple of offset, beat length, meter, sample set, sample index, volume, uninherited and effects,
+        whatever old formats leave out is filled in with osu!'s defaults
+        """
+        defaults = (0, 0, 4, 0, 0, 100, 1, 0)
+        values = [float(fields[0]), float(fields[1])]
+        values += [int(fields[i]) if i < len(fields) and fields[i].strip() else defaults[i] for i in range(2, 8)]
+        return tuple(values)
+
+    def parse_timing_points(self, beatmap):
+        rows = [OsuParser.timing_point(line.split(b',')) for line in self.lines('TimingPoints')]
+        rows.sort(key=lambda row: row[0])
+        for offset, beat_length, meter, sample_set, sample_index, volume, uninherited, effects in rows:
+            beatmap.offsets.append(offset)
+            beatmap.beat_lengths.append(beat_length)
+            beatmap.meters.append(meter)
+            beatmap.sample_sets.append(sample_set)
+            beatmap.sample_indices.append(sample_index)
+            beatmap.volumes.append(volume)
+            beatmap.uninherited.append(1 if uninherited else 0)
+            beatmap.effects.append(effects)
+        beatmap.index_bases()
+
+    @classmethod
+    def end_time(cls, beatmap, fields, time, kind, slider_multiplier):
+        # when a hit object is over, sliders take their length, velocity and repeats into account
+        if kind & 8 and len(fields) > 5:
+            return int(fields[5])
+        if kind & 128 and len(fields) > 5:
+            return int(fields[5].split(b':')[0])
+        if kind & 2 and len(fields) > 7:
+            velocity = slider_multiplier * 100 * beatmap.slider_velocity_at(time)
+            if velocity <= 0:
+                return time
+            length = float(fields[7]) / velocity * beatmap.beat_length_at(time)
+            return time + int(round(length * int(fields[6])))
+        return time
+
+    def parse_hit_objects(self, beatmap):
+        slider_multiplier = float(beatmap.value('Difficulty', 'SliderMultiplier', 1.4))
+        rows = list()
+        for line in self.lines('HitObjects'):
+            fields = line.split(b',')
+            if len(fields) < 4:
+                continue
+            time = int(round(float(fields[2])))
+            kind = int(fields[3])
+            rows.append((time, OsuParser.end_time(beatmap, fields, time, kind, slider_multiplier),
+                         int(round(float(fields[0]))), int(round(float(fields[1]))), kind,
+                         int(fields[4]) if len(fields) > 4 else 0))
+        rows.sort(key=lambda row: row[0])
+        for time, end_time, x, y, kind, hitsound in rows:
+            beatmap.times.append(time)
+            beatmap.end_times.append(end_time)
+            beatmap.xs.append(x)
+            beatmap.ys.append(y)
+            beatmap.types.append(kind)
+            beatmap.hitsounds.append(hitsound)
+
+    def parse(self, hit_objects=True):
+        """
+        :param hit_objects: parse [HitObjects] too, leave it out if only timing is needed
+        :return: Beatmap
+        """
+        beatmap = Beatmap()
+        for section in OsuParser.key_value_sections:
+            if section in self.sections:
+                beatmap.metadata[section] = self.key_values(section)
+        self.parse_timing_points(beatmap)
+        if hit_objects:
+            self.parse_hit_objects(beatmap)
+        return beatmap
@@ -0,0 +1,175 @@
+from inspect import isgeneratorfunction
+import json
+import time
+
+
+# Opt-in instrumentation for generation runs: records how long each effect took to apply and to render, how many
+# sprites and commands it made and how many bytes those rendered to. Storyboards and factories only call into it when
+# one is attached, so nothing is measured (or slowed down) otherwise
+class Profiler:
+    def __init__(self, sprites=True):
+        """
+        :param sprites: keep a record for every rendered sprite, turn off for huge storyboards where the totals per
+        effect are enough
+        """
+        self.keep_sprites = sprites
+        self.effects = dict()       # effect name -> record, in the order effects were added
+        self.sprites = list()       # one record per rendered sprite
+        self.builds = dict()        # (effect name, command type) -> [count, seconds]
+        self.hooks = list()
+        self.current = None         # effect being applied, Factory.build attributes its commands to it
+
+    @classmethod
+    def name(cls, effect, index) -> str:
+        # effects of the same class are told apart by their position on the storyboard
+        if effect is None:
+            return 'storyboard'
+        return '{}#{}'.format(type(effect).__name__, index)
+
+    @classmethod
+    def command_count(cls, sprite) -> int:
+        return len(sprite.commands) + (len(sprite.table) if sprite.table is not None else 0)
+
+    def hook(self, callback):
+        """
+        registers a function that gets called with (event, record) for every 'effect', 'sprite' and 'build' that is
+        recorded, e.g. to stream progress somewhere
+        :param callback: the function
+        :return: the callback, so this works as a decorator too
+        """
+        self.hooks.append(callback)
+        return callback
+
+    def emit(self, event, record):
+        for callback in self.hooks:
+            callback(event, record)
+
+    def effect_record(self, name) -> dict:
+        record = self.effects.get(name)
+        if record is None:
+            record = {'name': name, 'apply_seconds': 0.0, 'sprites': 0, 'commands': 0,
+                      'render_seconds': 0.0, 'bytes': 0, 'rendered': 0}
+            self.effects[name] = record
+        return record
+
+    def apply(self, effect, index):
+        """
+        applies an effect while timing it, see Storyboard.append_effect
+        :param effect: the effect
+        :param index: position the effect will have on the storyboard
+        """
+        name = Profiler.name(effect, index)
+        self.current = name
+        clock = time.perf_counter()
+        try:
+            effect.apply()
+        finally:
+            elapsed = time.perf_counter() - clock
+            self.current = None
+
+        record = self.effect_record(name)
+        record['apply_seconds'] += elapsed
+        # lazy effects don't have any sprites yet, they're counted while rendering
+        if not isgeneratorfunction(effect.get_sprites):
+            sprites = effect.get_sprites()
+            record['sprites'] += len(sprites)
+            record['commands'] += sum(Profiler.command_count(sprite) for sprite in sprites)
+        self.emit('effect', record)
+
+    def build(self, t, seconds):
+        # a single command went through Factory.build
+        entry = self.builds.setdefault((self.current or 'storyboard', t), [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+        if self.hooks:
+            self.emit('build', {'effect': self.current or 'storyboard', 'type': t, 'seconds': seconds})
+
+    def iter_lines(self, storyboard):
+        """
+        renders a storyboard like Storyboard.iter_lines does while timing every sprite
+        :param storyboard: the storyboard
+        :return: generator of output lines without line breaks
+        """
+        sources = [(Profiler.name(effect, index), effect, index) for index, effect in enumerate(storyboard.effects)]
+        sources.append(('storyboard', None, None))
+
+        for name, effect, index in sources:
+            record = self.effect_record(name)
+            lazy = effect is not None and isgeneratorfunction(effect.get_sprites)
+            sprites = storyboard.sprites if effect is None else storyboard.effect_sprites(effect, index)
+            for sprite in sprites:
+                clock = time.perf_counter()
+                lines = list(sprite.iter_lines())
+                elapsed = time.perf_counter() - clock
+                size = sum(len(line.encode('utf8')) + 1 for line in lines)
+
+                record['render_seconds'] += elapsed
+                record['bytes'] += size
+                record['rendered'] += 1
+                if lazy:
+                    record['sprites'] += 1
+                    record['commands'] += Profiler.command_count(sprite)
+                if self.keep_sprites or self.hooks:
+                    entry = {'effect': name, 'path': sprite.path, 'seconds': elapsed, 'bytes': size,
+                             'commands': Profiler.command_count(sprite)}
+                    if self.keep_sprites:
+                        self.sprites.append(entry)
+                    self.emit('sprite', entry)
+                yield from lines
+
+    def report(self) -> dict:
+        """
+        :return: dictionary with a record per effect, per sprite (if kept) and per effect and command type built
+        """
+        builds = [{'effect': effect, 'type': t, 'count': count, 'seconds': seconds}
+                  for (effect, t), (count, seconds) in self.builds.items()]
+        return {'effects': list(self.effects.values()),
+                'sprites': list(self.sprites),
+                'builds': builds}
+
+    def to_json(self, path=None, indent=2):
+        """
+        :param path: file to write the report to, None only returns it
+        :return: the report as JSON text
+        """
+        text = json.dumps(self.report(), indent=indent)
+        if path is not None:
+            with open(path, 'w', encoding='utf8') as file:
+                file.write(text)
+        return text
+
+    def folded(self) -> list:
+        """
+        the report in the folded stack format flamegraph tools read, one 'frame;frame;frame microseconds' line per
+        stack. Sprites are summed up per image so the graph stays readable
+        :return: list of lines
+        """
+        stacks = dict()
+
+        def add(stack, seconds):
+            stacks[stack] = stacks.get(stack, 0) + seconds
+
+        def prefix(name):
+            # sprites added to the storyboard directly sit right under the root
+            return 'storyboard' if name == 'storyboard' else 'storyboard;' + name
+
+        for record in self.effects.values():
+            add(prefix(record['name']) + ';apply', record['apply_seconds'])
+            if not self.sprites:
+                add(prefix(record['name']) + ';render', record['render_seconds'])
+        for (effect, t), (_, seconds) in self.builds.items():
+            if effect == 'storyboard':
+                add('storyboard;build ' + t, seconds)
+                continue
+            # builds happen while applying, they're part of that time and not on top of it
+            add(prefix(effect) + ';apply;build ' + t, seconds)
+            add(prefix(effect) + ';apply', -seconds)
+        for entry in self.sprites:
+            add(prefix(entry['effect']) + ';render;' + entry['path'].replace(';', '_'), entry['seconds'])
+
+        return ['{} {}'.format(stack, int(round(seconds * 1e6))) for stack, seconds in stacks.items()
+                if seconds > 0]
+
+    def write_folded(self, path):
+        with open(path, 'w', encoding='utf8') as file:
+            file.write(''.join(line + '\n' for line in self.folded()))
@@ -0,0 +1,169 @@
+from array import array
+from Command import Command
+import Easing
+
+
+# Interpolated state of many sprites at many points in time. Every property is one flat array holding
+# all timestamps of the first sprite, then all timestamps of the second one and so on
+class StateTable:
+    fields = ('x', 'y', 'opacity', 'scale_x', 'scale_y', 'rotation', 'r', 'g', 'b')
+
+    # command type -> timelines its values feed, in the order of its values
+    timelines = {'F': ('opacity',),
+                 'M': ('x', 'y'),
+                 'MX': ('x',),
+                 'MY': ('y',),
+                 'S': ('scale',),
+                 'V': ('vector_x', 'vector_y'),
+                 'R': ('rotation',),
+                 'C': ('r', 'g', 'b')}
+
+    # what a property is before any command touches it
+    defaults = {'opacity': 1.0, 'scale': 1.0, 'vector_x': 1.0, 'vector_y': 1.0, 'rotation': 0.0,
+                'r': 255.0, 'g': 255.0, 'b': 255.0}
+
+    def __init__(self, times):
+        """
+        :param times: timestamps the sprites get evaluated at
+        """
+        self.paths = list()         # image paths of the evaluated sprites, in the order they were evaluated
+        self.times = array('d', times)
+        self.columns = {field: array('d') for field in StateTable.fields}
+
+    def __len__(self):
+        return len(self.paths)
+
+    def append(self, path, values):
+        """
+        adds the sampled properties of one more sprite
+        :param path: image path of the sprite
+        :param values: dictionary of field -> values for every timestamp
+        """
+        self.paths.append(path)
+        for field in StateTable.fields:
+            self.columns[field].extend(values[field])
+
+    def index(self, sprite, time) -> int:
+        # position of a sprite index and time index in the flat columns
+        return sprite * len(self.times) + time
+
+    def value(self, field, sprite, time) -> float:
+        return self.columns[field][self.index(sprite, time)]
+
+    def state(self, sprite, time) -> dict:
+        """
+        :param sprite: index of the sprite
+        :param time: index of the timestamp
+        :return: dictionary of every property
+        """
+        i = self.index(sprite, time)
+        return {field: self.columns[field][i] for field in StateTable.fields}
+
+    def series(self, field, sprite):
+        # one property of one sprite over all timestamps
+        start = self.index(sprite, 0)
+        return self.columns[field][start:start + len(self.times)]
+
+    @classmethod
+    def commands(cls, sbobj) -> list:
+        # what the renderer would write for the object, with loops expanded into absolute commands
+        commands = list(sbobj.commands)
+        if sbobj.table is not None:
+            commands.extend(sbobj.table)
+
+        expanded = list()
+        for command in Command.visible(sorted(dict.fromkeys(commands))):
+            if command.t == 'L':
+                expanded.extend(command.expand())
+            else:
+                expanded.append(command)
+        return expanded
+
+    @classmethod
+    def build_timelines(cls, commands) -> dict:
+        """
+        splits commands into one timeline per property
+        :param commands: plain commands
+        :return: dictionary of property -> list of (start, end, easing, start value, end value) sorted by start
+        """
+        timelines = dict()
+        for command in commands:
+            names = StateTable.timelines.get(command.t)
+            if names is None:
+                continue
+            start_params, end_params = command.params()
+            for name, start_value, end_value in zip(names, start_params, end_params):
+                timelines.setdefault(name, list()).append((command.start_time, command.end_time, command.easing,
+                                                           float(start_value), float(end_value)))
+        for timeline in timelines.values():
+            timeline.sort(key=lambda segment: segment[0])
+        return timelines
+
+    @classmethod
+    def sample(cls, timeline, times, order, default):
+        """
+        evaluates one timeline at every timestamp in a single sweep: the command that started last before a
+        timestamp decides its value, before the first command its start value applies and after a command ended
+        its end value is held
+        :param timeline: segments as build_timelines makes them
+        :param times: timestamps
+        :param order: indices of times sorted by time
+        :param default: value if there is no command at all
+        :return: list of values in the order of times
+        """
+        values = [default] * len(times)
+        if not timeline:
+            return values
+
+        ease = Easing.ease
+        first = timeline[0][3]
+        count = len(timeline)
+        j = 0
+        for k in order:
+            time = times[k]
+            while j < count and timeline[j][0] <= time:
+                j += 1
+            if j == 0:
+                values[k] = first
+                continue
+            start, end, easing, start_value, end_value = timeline[j - 1]
+            if time >= end:
+                values[k] = end_value
+            else:
+                values[k] = start_value + (end_value - start_value) * ease(easing, (time - start) / (end - start))
+        return values
+
+    @classmethod
+    def evaluate(cls, sprites, times):
+        """
+        computes the state of every sprite at every timestamp
+        :param sprites: iterable of sprites and animations
+        :param times: timestamps in ms
+        :return: StateTable, opacity is 0 while a sprite isn't alive (before its first or after its last command)
+        """
+        times = [float(time) for time in times]
+        order = sorted(range(len(times)), key=times.__getitem__)
+        table = StateTable(times)
+
+        for sbobj in sprites:
+            commands = StateTable.commands(sbobj)
+            timelines = StateTable.build_timelines(commands)
+            born = min((command.start_time for command in commands), default=None)
+            dies = max((command.end_time for command in commands), default=None)
+
+            values = {name: StateTable.sample(timelines.get(name), times, order, StateTable.defaults[name])
+                      for name in StateTable.defaults}
+            values['x'] = StateTable.sample(timelines.get('x'), times, order, float(sbobj.x))
+            values['y'] = StateTable.sample(timelines.get('y'), times, order, float(sbobj.y))
+
+            opacity = values['opacity']
+            for k, time in enumerate(times):
+                if born is None or time < born or time > dies:
+                    opacity[k] = 0.0
+
+            # scale and vector scale multiply
+            values['scale_x'] = [s * v for s, v in zip(values['scale'], values['vector_x'])]
+            values['scale_y'] = [s * v for s, v in zip(values['scale'], values['vector_y'])]
+            table.append(sbobj.path, values)
+
+        return table
@@ -1,10 +1,39 @@
+from collections import deque
+from inspect import isgeneratorfunction
+from itertools import islice
+from multiprocessing import Pool
+import os
+import Analyzer
 import Constants
 import Object
 import Command
+import Optimizer
+import Parser
+import State
+from Timing import TimingMap
+
+
+def apply_effect(effect):
+    """
+    applies a single effect, used by the worker processes of Storyboard.apply_effects
+    :param effect: the effect
+    :return: the applied effect
+    """
+    effect.apply()
+    return effect
+
+
+def render_sprites(sprites):
+    """
+    renders a batch of sprites into one chunk of text, used by the worker processes of Storyboard.to_osb
+    :param sprites: list of sprites
+    :return: the rendered sprites joined together
+    """
+    return ''.join(sprite.render() for sprite in sprites)
 
 
 class Storyboard:
-    def __init__(self, song_folder, timing_point_file, sb_folder=""):
+    def __init__(self, song_folder, timing_point_file, sb_folder="", seed=None, beatmap_cache=None, beatmap=None):
 
         # reformat song_folder if it's not ending in /
         if song_folder[-1:] != '\\' or song_folder[-1:] != '/':
@@ -21,73 +50,134 @@ class Storyboard:
         # effects
         self.effects = list()
 
-        # all timing points of the difficulty
+        # all uninherited timing points of the difficulty, everything else it has to offer is in beatmap
         self.timing_points = dict()
+        self.timing_map = None
+        self.beatmap = None
+
+        # optional Cache.BeatmapCache, parsed difficulties are taken from and put into it
+        self.beatmap_cache = beatmap_cache
 
         # file name of the .osb
         self.osb_file_name = str()
 
-        # just read the .osu provided into the file
-        self.parse_osu_difficulty(timing_point_file)
-
-    def parse_osu_difficulty(self, timing_point_file):
-
-        # start reading?
-        start = 0
-
-        # timing point index
-        i = 0
-
-        # difficulty name
-        ver = str()
-
-        # get the timing points from an .osu in the folder
-        with open(self.song_folder + timing_point_file, 'r', encoding="utf8") as file:
-            for line in file:
-                if 'Version:' in line:  # difficulty name
-                    ver += line.strip('Version:')
-                if '[Colours]\n' == line:  # anything after this is not interesting
-                    break
-                elif start == 1:  # reading started?
-                    parameters = line.split(',')
-                    # the last line is just an empty line so it'll hold \n only and thus only create 1 element
-                    if len(parameters) == 8 and int(parameters[6]) == 1:
-                        self.timing_points[i] = dict()
-                        self.timing_points[i]['offset'] = int(parameters[0])  # offset of the timing point
-                        self.timing_points[i]['ms'] = float(parameters[1])  # ms per beat
-                        self.timing_points[i]['bpm'] = round(60000 / float(parameters[1]), 3)  # bpm rounded to 3 last
-                        self.timing_points[i]['meter'] = int(parameters[2])  # the meter of the song
-                        self.timing_points[i]['sample'] = int(parameters[3])  # sampleset of the line
-                        self.timing_points[i]['sindex'] = int(parameters[4])  # sampleset index
-                        self.timing_points[i]['vol'] = int(parameters[5])  # volume
-                        self.timing_points[i]['inherit'] = int(parameters[6])  # inherited point?
-                        self.timing_points[i]['kiai'] = int(parameters[7])  # kiai mode
-                        i += 1
-                elif '[TimingPoints]' in line:  # ensure to start reading after the timing points line
-                    start = 1
-
-        # deduce the name the .osb file needs to have based on the difficulty filename it has received
-        self.osb_file_name = timing_point_file.strip(' [' + ver + '].osu') + '.osb'
+        # optional Profiler.Profiler, records effects, builds and renders while one is attached
+        self.profiler = None
 
-    def render(self):
+        # effects get their random generators seeded from this and their position, None leaves them alone
+        self.seed = seed
+
+        # just read the .osu provided into the file, unless it was parsed already
+        self.parse_osu_difficulty(timing_point_file, beatmap)
+
+    def parse_osu_difficulty(self, timing_point_file, beatmap=None):
         """
-        kickstarts rendering all children
+        reads timing points, hit objects and metadata of a difficulty, see Parser.OsuParser, or takes them from the
+        beatmap cache
+        :param timing_point_file: file name of the .osu in the song folder
+        :param beatmap: Parser.Beatmap of the file if it was parsed already, e.g. by Mapset.Mapset
+        """
+        path = self.song_folder + timing_point_file
+        if beatmap is not None:
+            self.beatmap = beatmap
+        elif self.beatmap_cache is not None:
+            self.beatmap = self.beatmap_cache.get(path)
+        else:
+            self.beatmap = Parser.OsuParser(path).parse()
 
-        :return: the whole output the SB knows as a string
+        # the uninherited timing points, indexed once for every factory to share
+        self.timing_points = self.beatmap.timing_points()
+        self.timing_map = TimingMap(self.timing_points)
+
+        # deduce the name the .osb file needs to have based on the difficulty filename it has received,
+        # 'Artist - Title (Creator) [Version].osu' becomes 'Artist - Title (Creator).osb'
+        name = timing_point_file[:-len('.osu')] if timing_point_file.endswith('.osu') else timing_point_file
+        suffix = ' [{}]'.format(self.beatmap.version)
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+        self.osb_file_name = name + '.osb'
+
+    def iter_sprites(self):
+        """
+        walks over every sprite the storyboard will render, effects first
+
+        :return: generator of sprites in render order
+        """
+        for index, effect in enumerate(self.effects):
+            yield from self.effect_sprites(effect, index)
+        yield from self.sprites
+
+    @classmethod
+    def is_lazy(cls, effect) -> bool:
+        # lazy effects generate their sprites while being rendered instead of keeping them around
+        return isgeneratorfunction(effect.get_sprites)
+
+    def effect_sprites(self, effect, index):
+        """
+        the sprites of a single effect. Lazy effects are reseeded first, so they generate the same sprites every time
+        :param effect: the effect
+        :param index: position of the effect on the storyboard
+        :return: list of sprites or generator for lazy effects
         """
-        output = str()
+        if Storyboard.is_lazy(effect):
+            self.seed_effect(effect, index)
+        return effect.get_sprites()
 
-        # render all effects
+    def iter_stored_sprites(self):
+        # only the sprites that exist in between renders, lazy effects are skipped
         for effect in self.effects:
-            spr = effect.get_sprites()
-            for sprite in spr:
-                output += sprite.render()
+            if not Storyboard.is_lazy(effect):
+                yield from effect.get_sprites()
+        yield from self.sprites
 
-        # all sprites
-        for sprite in self.sprites:
-            output += sprite.render()
+    def cache_stats(self):
+        """
+        sums up the render cache counters of all sprites, see Object.SBObj.cache_renders
+        :return: dictionary with hits, misses and the amount of sprites currently cached
+        """
+        stats = {'hits': 0, 'misses': 0, 'cached': 0}
+        for sprite in self.iter_stored_sprites():
+            stats['hits'] += sprite.cache_hits
+            stats['misses'] += sprite.cache_misses
+            stats['cached'] += not sprite.dirty and sprite.rendered is not None
+        return stats
+
+    def sprite_count(self, limit=None):
+        """
+        :param limit: stop counting once this many sprites were found, lazy effects have to generate their sprites to
+        be counted
+        :return: amount of sprites that will be rendered, at most about limit
+        """
+        count = len(self.sprites)
+        for index, effect in enumerate(self.effects):
+            if limit is not None and count >= limit:
+                break
+            if Storyboard.is_lazy(effect):
+                remaining = None if limit is None else limit - count
+                count += sum(1 for _ in islice(self.effect_sprites(effect, index), remaining))
+            else:
+                count += len(effect.get_sprites())
+        return count
 
-        return output
+    def iter_lines(self):
+        """
+        lazily renders all children line by line, so only one sprite is being worked on at a time
+
+        :return: generator of output lines without line breaks
+        """
+        if self.profiler is not None:
+            yield from self.profiler.iter_lines(self)
+            return
+        for sprite in self.iter_sprites():
+            yield from sprite.iter_lines()
+
+    def render(self):
+        """
+        kickstarts rendering all children
+
+        :return: the whole output the SB knows as a string
+        """
+        return ''.join(line + '\n' for line in self.iter_lines())
 
     def new_sprite(self, path, layer=Constants.la['bg'], origin=Constants.o['cc'], x=320, y=240, use_folder=True):
         """
@@ -131,30 +221,244 @@ class Storyboard:
         self.current_sprite = animation
         return animation
 
-    def new_command_factory(self):
+    def new_command_factory(self, pool=None):
         """
         creates a new timeline-aware command factory without anything in it
+        :param pool: optional Command.CommandPool to share identical commands through
         :return:
         """
-        return Command.Factory(self.timing_points)
+        return Command.Factory(self.timing_map, pool, self.profiler)
 
-    def to_osb(self):
+    def to_osb(self, chunk_size=1 << 16, processes=1, sprites_per_task=256, parallel_threshold=4096, compact=False,
+               verify=False):
         """
-        renders each sprite in chunks to an .osb file
+        streams the rendered lines to an .osb file, writing them out in chunks
+        :param chunk_size: rough amount of characters collected before each write
+        :param processes: worker processes to render with, None uses every core and 1 renders serially
+        :param sprites_per_task: amount of sprites each worker renders into one chunk
+        :param parallel_threshold: storyboards with fewer sprites than this are always rendered serially
+        :param compact: replace repeated strings with [Variables] once written, see Optimizer.Compactor
+        :param verify: check that the compacted file expands back to what was rendered
+        :return: the report of Optimizer.Compactor.compact when compacting, None otherwise
         """
-        with open(self.song_folder + self.osb_file_name, 'w', encoding='utf8') as file:
+        self.write_osb(chunk_size, processes, sprites_per_task, parallel_threshold)
+        if compact:
+            return Optimizer.Compactor().compact(self.song_folder + self.osb_file_name, verify)
+
+    def write_osb(self, chunk_size, processes, sprites_per_task, parallel_threshold):
+        # the plain rendering part of to_osb
+        # sprites can only be timed one by one while a profiler is attached
+        parallel = processes != 1 and self.profiler is None and \
+            self.sprite_count(parallel_threshold) >= parallel_threshold
+
+        with open(self.song_folder + self.osb_file_name, 'w', encoding='utf8', buffering=chunk_size) as file:
             file.write("[Events]\n")
-            # render all effects
-            for effect in self.effects:
-                spr = effect.get_sprites()
-                for sprite in spr:
-                    file.write(sprite.render())
 
-            # render all sprites
-            for sprite in self.sprites:
-                file.write(sprite.render())
+            if parallel:
+                # sprites render independently. Only a few batches are handed out at a time and written in the order
+                # they were sent out, so lazy effects never have more than those in memory
+                window = 2 * (processes or os.cpu_count() or 1)
+                with Pool(processes) as pool:
+                    pending = deque()
+                    for batch in self.iter_sprite_batches(sprites_per_task):
+                        pending.append(pool.apply_async(render_sprites, (batch,)))
+                        if len(pending) >= window:
+                            file.write(pending.popleft().get())
+                    while pending:
+                        file.write(pending.popleft().get())
+                return
+
+            chunk = list()
+            size = 0
+            for line in self.iter_lines():
+                chunk.append(line)
+                size += len(line) + 1
+                if size >= chunk_size:
+                    chunk.append('')
+                    file.write('\n'.join(chunk))
+                    chunk = list()
+                    size = 0
+
+            # whatever is left over
+            if chunk:
+                chunk.append('')
+                file.write('\n'.join(chunk))
+
+    def iter_sprite_batches(self, size):
+        """
+        splits the sprites into lists of at most size sprites, keeping render order
+        :param size: sprites per batch
+        :return: generator of sprite lists
+        """
+        sprites = self.iter_sprites()
+        batch = list(islice(sprites, size))
+        while batch:
+            yield batch
+            batch = list(islice(sprites, size))
+
+    def seed_effect(self, effect, index):
+        """
+        reseeds the random generator of an effect from the storyboard seed and the position of the effect, so every
+        effect draws the same numbers no matter where or in which order it's applied
+        :param effect: the effect
+        :param index: position the effect has on the storyboard
+        """
+        if self.seed is not None:
+            effect.random.seed('{}:{}'.format(self.seed, index))
 
     def append_effect(self, effect):
-        effect.apply()
+        self.seed_effect(effect, len(self.effects))
+        if self.profiler is not None:
+            self.profiler.apply(effect, len(self.effects))
+        else:
+            effect.apply()
         self.effects.append(effect)
 
+    def apply_effects(self, effects, processes=None):
+        """
+        applies a batch of independent effects in worker processes and appends them in the order given. With a
+        seed on the storyboard the output is the same for any amount of workers as long as the effects draw their
+        random numbers from effect.random
+        :param effects: iterable of effects, they and their factories have to be picklable
+        :param processes: worker processes, None uses every core and 1 applies them one after another
+        :return: list of the applied effects. Effects applied in workers come back as copies, use these instead of
+        the ones passed in
+        """
+        effects = list(effects)
+        if processes == 1 or len(effects) < 2 or self.profiler is not None:
+            for effect in effects:
+                self.append_effect(effect)
+            return effects
+
+        for index, effect in enumerate(effects, len(self.effects)):
+            self.seed_effect(effect, index)
+        with Pool(processes) as pool:
+            applied = pool.map(apply_effect, effects)
+        self.effects.extend(applied)
+        return applied
+
+    def optimize(self, loops=True):
+        """
+        merges, drops and folds the commands of every sprite without changing how they animate, sprites of lazy
+        effects only exist while rendering and are left alone
+        :param loops: fold repeating blocks of commands into loops
+        :return: list of dictionaries reporting command counts and bytes saved per sprite
+        """
+        optimizer = Optimizer.Optimizer(loops)
+        return [optimizer.optimize(sprite) for sprite in self.iter_stored_sprites()]
+
+    def cull(self, margin=None):
+        """
+        removes sprites that can't ever be seen and commands that run while their sprite can't be seen, see
+        Optimizer.Culler. Sprites of lazy effects are left alone
+        :param margin: largest distance from a sprite's position to any of its pixels at scale 1 (a number or a
+        function receiving the sprite), enables culling sprites that stay off screen. None only culls by opacity
+        and scale
+        :return: dictionary with the totals and the reports of every sprite something was removed from
+        """
+        culler = Optimizer.Culler(margin)
+        summary = {'sprites_removed': 0, 'commands_dropped': 0, 'commands_truncated': 0, 'bytes_saved': 0,
+                   'sprites': list()}
+
+        def kept(sprites):
+            remaining = list()
+            for sprite in sprites:
+                report = culler.cull(sprite)
+                summary['commands_dropped'] += report['dropped']
+                summary['commands_truncated'] += report['truncated']
+                summary['bytes_saved'] += report['bytes_before'] - report['bytes_after']
+                if report['removed'] is not None:
+                    summary['sprites_removed'] += 1
+                else:
+                    remaining.append(sprite)
+                if report['removed'] is not None or report['dropped'] or report['truncated']:
+                    summary['sprites'].append(report)
+            return remaining
+
+        for effect in self.effects:
+            if not Storyboard.is_lazy(effect):
+                effect.sprites = kept(effect.get_sprites())
+        self.sprites = kept(self.sprites)
+        if self.current_sprite is not None and self.current_sprite not in self.sprites:
+            self.current_sprite = None
+        return summary
+
+    def pool_sprites(self, window=1024):
+        """
+        lets sprites take over the commands of later sprites showing the same image once they're done, so the client
+        has fewer sprites to deal with, see Optimizer.Pooler. Lazy effects are left alone and nothing is pooled across
+        them
+        :param window: how many sprites back a sprite may be moved in draw order
+        :return: dictionary with the sprite counts before and after
+        """
+        pooler = Optimizer.Pooler(window)
+
+        # runs of sprites without a lazy effect in between are pooled together
+        runs = [list()]
+        for effect in self.effects:
+            if Storyboard.is_lazy(effect):
+                runs.append(list())
+            else:
+                runs[-1].extend(effect.get_sprites())
+        runs[-1].extend(self.sprites)
+
+        before = sum(len(run) for run in runs)
+        removed = set()
+        reused = 0
+        for run in runs:
+            taken, heads = pooler.pool(run)
+            removed |= taken
+            reused += heads
+
+        for effect in self.effects:
+            if not Storyboard.is_lazy(effect):
+                effect.sprites = [sprite for sprite in effect.get_sprites() if id(sprite) not in removed]
+        self.sprites = [sprite for sprite in self.sprites if id(sprite) not in removed]
+        if self.current_sprite is not None and id(self.current_sprite) in removed:
+            self.current_sprite = None
+
+        return {'sprites_before': before,
+                'sprites_after': before - len(removed),
+                'pooled': len(removed),
+                'reused': reused,
+                'reduction': len(removed) / before if before else 0.0}
+
+    def state_at(self, times):
+        """
+        evaluates position, opacity, scale, rotation and color of every sprite at every timestamp
+        :param times: timestamps in ms
+        :return: State.StateTable with one row per sprite in render order
+        """
+        return State.StateTable.evaluate(self.iter_sprites(), times)
+
+    def analyze(self, images=None, cache_path=None, count=5, width=1000, responsible=10):
+        """
+        estimates how many sprites are alive and how many pixels they cover over time, see Analyzer.Analyzer
+        :param images: Analyzer.ImageIndex to take image sizes from, by default the sb folder gets indexed
+        :param cache_path: file the image index keeps the dimensions it read in between runs
+        :param count: amount of peak windows to report per metric
+        :param width: length of the windows in ms
+        :param responsible: amount of sprites to name per window
+        :return: dictionary, see Analyzer.Analyzer.report
+        """
+        if images is None:
+            images = Analyzer.ImageIndex(self.song_folder, self.sb_folder, cache_path)
+        return Analyzer.Analyzer(self.iter_sprites(), images).report(count, width, responsible)
+
+    def load_osb(self, path=None, filter=None, table=False):
+        """
+        reads the sprites of an existing .osb into the storyboard
+        :param path: file to read, defaults to the .osb of this storyboard
+        :param filter: optional function receiving each object, the commands of objects it returns False for
+        are never parsed and the objects are dropped
+        :param table: keep the commands of loaded objects in columnar storage
+        :return: list of the loaded objects
+        """
+        if path is None:
+            path = self.song_folder + self.osb_file_name
+
+        sprites = Parser.OsbParser(path).load(filter, table)
+        self.sprites.extend(sprites)
+        if sprites:
+            self.current_sprite = sprites[-1]
+        return sprites
@@ -0,0 +1,117 @@
+from array import array
+from bisect import bisect_right
+
+
+# Sorted view over the uninherited timing points of a difficulty, finds the point that applies
+# to a timestamp by bisecting instead of walking the whole list
+class TimingMap:
+
+    def __init__(self, timing_points):
+        """
+        :param timing_points: dictionary of timing point dictionaries as Storyboard.parse_osu_difficulty builds it
+        """
+        self.timing_points = timing_points
+
+        # sorting is stable, so of two points on the same offset the later one in the file wins like it does in osu!
+        self.points = sorted(timing_points.values(), key=lambda point: point['offset'])
+        self.offsets = array('d', [point['offset'] for point in self.points])
+        self.beat_lengths = array('d', [point['ms'] for point in self.points])
+
+    def __len__(self):
+        return len(self.points)
+
+    def index_at(self, time) -> int:
+        """
+        :param time: timestamp in ms
+        :return: index of the last timing point starting at or before time, the first point also covers
+        everything before it
+        """
+        i = bisect_right(self.offsets, time) - 1
+        return i if i > 0 else 0
+
+    def point_at(self, time) -> dict:
+        return self.points[self.index_at(time)]
+
+    def beat_length_at(self, time) -> float:
+        return self.beat_lengths[self.index_at(time)]
+
+    @classmethod
+    def fraction(cls, duration):
+        """
+        reads a beat fraction
+        :param duration: '1/2', ('1', '2') or a plain number of beats
+        :return: amount of beats as float or None if it couldn't make sense of it
+        """
+        if isinstance(duration, str):
+            duration = duration.split('/')
+        if isinstance(duration, (list, tuple)):
+            if len(duration) == 2:
+                return float(duration[0]) / float(duration[1])
+            return None
+        return float(duration)
+
+    def to_ms(self, reference_timestamp, duration):
+        """
+        length of a beat fraction at a point in the song
+        :param reference_timestamp: time in ms the duration starts at
+        :param duration: beat fraction, see fraction
+        :return: length in ms as float or None if the duration isn't a fraction
+        """
+        beats = TimingMap.fraction(duration)
+        if beats is None:
+            return None
+
+        # e.g. 400 ms per beat * 1 / 2 = half a beat if 1 beat is 400 ms
+        return self.beat_lengths[self.index_at(reference_timestamp)] * beats
+
+    def many_to_ms(self, reference_timestamps, durations):
+        """
+        converts lots of beat fractions at once
+        :param reference_timestamps: sequence of times in ms
+        :param durations: a single beat fraction for all of them or a sequence of fractions, one per timestamp
+        :return: array of lengths in ms
+        """
+        offsets = self.offsets
+        beat_lengths = self.beat_lengths
+
+        if isinstance(durations, (str, int, float)):
+            beats = TimingMap.fraction(durations)
+            beats = [beats] * len(reference_timestamps)
+        else:
+            beats = [TimingMap.fraction(duration) for duration in durations]
+
+        lengths = array('d')
+        for timestamp, beat in zip(reference_timestamps, beats):
+            i = bisect_right(offsets, timestamp) - 1
+            lengths.append(beat_lengths[i if i > 0 else 0] * beat)
+        return lengths
+
+    def snap(self, time, divisor=1) -> int:
+        """
+        snaps a timestamp to the closest tick of the beat divisor of the timing point that applies to it
+        :param time: timestamp in ms
+        :param divisor: beat divisor, 4 snaps to 1/4 beats
+        :return: snapped timestamp in ms
+        """
+        i = self.index_at(time)
+        step = self.beat_lengths[i] / divisor
+        offset = self.offsets[i]
+        return int(round(offset + round((time - offset) / step) * step))
+
+    def snap_many(self, times, divisor=1):
+        """
+        snaps lots of timestamps at once
+        :param times: sequence of timestamps in ms
+        :param divisor: beat divisor
+        :return: array of snapped timestamps
+        """
+        offsets = self.offsets
+        beat_lengths = self.beat_lengths
+
+        snapped = array('i')
+        for time in times:
+            i = bisect_right(offsets, time) - 1
+            i = i if i > 0 else 0
+            step = beat_lengths[i] / divisor
+            snapped.append(int(round(offsets[i] + round((time - offsets[i]) / step) * step)))
+        return snapped
@@ -0,0 +1,77 @@
+import math
+import pytest
+from Benchmark import synthetic_storyboard
+from Command import CommandTable
+import Easing
+
+
+def bake(tmp_path, t, function, tolerance, end=2000):
+    storyboard, _ = synthetic_storyboard(str(tmp_path), sprites=0)
+    factory = storyboard.new_command_factory()
+    factory.type(t)
+    return factory.bake(function, 0, end, tolerance=tolerance)
+
+
+def target(t, value):
+    # what bake measures against: values out of range clamped, whole number types exact
+    _, clean, out = CommandTable.spec[t]
+    return value if out is int else clean(value)
+
+
+def largest_error(commands, function):
+    # compares the baked commands with the function at every ms they cover
+    error = 0.0
+    for command in commands:
+        (start,), (end,) = command.params()
+        ease = Easing.function(command.easing)
+        duration = command.end_time - command.start_time
+        for time in range(command.start_time, command.end_time + 1):
+            progress = ease((time - command.start_time) / duration) if duration else 1.0
+            error = max(error, abs(start + (end - start) * progress - target(command.t, function(time))))
+    return error
+
+
+def assert_continuous(commands, end):
+    assert commands[0].start_time == 0 and commands[-1].end_time == end
+    assert all(first.end_time == second.start_time for first, second in zip(commands, commands[1:]))
+
+
+@pytest.mark.parametrize('t, function, tolerance', [
+    ('MX', lambda time: 320 + 200 * math.sin(time / 150), 1.0),
+    ('F', lambda time: 0.5 + 0.5 * math.sin(time / 90), 0.01),
+])
+def test_bake_stays_within_tolerance_between_samples(tmp_path, t, function, tolerance):
+    commands = bake(tmp_path, t, function, tolerance)
+
+    assert_continuous(commands, 2000)
+    assert largest_error(commands, function) <= tolerance
+
+
+def test_bake_of_values_out_of_range_holds_the_clamped_value(tmp_path):
+    function = lambda time: -0.5 + time / 1000
+    commands = bake(tmp_path, 'S', function, 0.01, end=5000)
+
+    assert_continuous(commands, 5000)
+    assert largest_error(commands, function) <= 0.01
+    assert commands[0].params()[0] == (0.0,)
+    assert len(commands) <= 5
+
+
+def test_bake_of_clipped_opacity_stays_compact(tmp_path):
+    function = lambda time: 1.5 * math.sin(time / 300)
+    commands = bake(tmp_path, 'F', function, 0.01, end=10000)
+
+    assert_continuous(commands, 10000)
+    assert largest_error(commands, function) <= 0.01
+    # plain stepping every 10 ms would take 1000 commands
+    assert len(commands) < 300
+
+
+def test_bake_below_rounding_still_makes_long_segments(tmp_path):
+    function = lambda time: time / 3
+    commands = bake(tmp_path, 'MX', function, 0.1, end=3000)
+
+    assert_continuous(commands, 3000)
+    # rounded endpoints are up to half a pixel off on their own
+    assert largest_error(commands, function) <= 0.5
+    assert len(commands) == 1
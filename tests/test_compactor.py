@@ -0,0 +1,63 @@
+import os
+import re
+from Benchmark import synthetic_storyboard
+from Optimizer import Compactor
+from Parser import OsbParser
+
+
+def expand_file(path):
+    # reads a compacted file back the way osu! does, through the [Variables] section
+    with open(path, encoding='utf8') as file:
+        lines = file.read().split('\n')
+    end = lines.index('')
+    definitions = dict(line.split('=', 1) for line in lines[1:end])
+    pattern = re.compile(r'\$[{}]{{2}}'.format(Compactor.alphabet))
+    return '\n'.join(Compactor.expand(line, pattern, definitions) for line in lines[end + 1:])
+
+
+def test_compacted_storyboard_expands_to_the_original(tmp_path):
+    storyboard, _ = synthetic_storyboard(str(tmp_path), sprites=300, commands=8, seed=3)
+    path = storyboard.song_folder + storyboard.osb_file_name
+    storyboard.to_osb()
+    with open(path, encoding='utf8') as file:
+        original = file.read()
+    plain = tmp_path / 'plain.osb'
+    plain.write_text(original, encoding='utf8')
+
+    report = storyboard.to_osb(compact=True)
+
+    assert report['aborted'] is None and report['variables'] > 0
+    assert report['bytes_saved'] == len(original.encode('utf8')) - os.path.getsize(path)
+    assert report['bytes_saved'] > 0
+    assert expand_file(path) == original
+    assert list(OsbParser(path).iter_lines()) == list(OsbParser(str(plain)).iter_lines())
+
+
+def test_verify_accepts_its_own_output(tmp_path):
+    storyboard, _ = synthetic_storyboard(str(tmp_path), sprites=50, commands=4, seed=4)
+
+    report = storyboard.to_osb(compact=True, verify=True)
+
+    assert report['verified']
+
+
+def test_files_using_variables_are_left_alone(tmp_path):
+    text = '[Events]\nSprite,Foreground,Centre,"sb/$x.png",320,240\n F,0,0,1,0,1\n' * 50
+    path = tmp_path / 'dollar.osb'
+    path.write_text(text, encoding='utf8')
+
+    report = Compactor().compact(str(path))
+
+    assert report['aborted'] == 'variables' and report['bytes_saved'] == 0
+    assert path.read_text(encoding='utf8') == text
+
+
+def test_unprofitable_files_are_left_alone(tmp_path):
+    text = '[Events]\nSprite,Foreground,Centre,"sb/a.png",320,240\n F,0,0,1000,0,1\n'
+    path = tmp_path / 'small.osb'
+    path.write_text(text, encoding='utf8')
+
+    report = Compactor().compact(str(path))
+
+    assert report['aborted'] == 'unprofitable' and report['variables'] == 0
+    assert path.read_text(encoding='utf8') == text
@@ -0,0 +1,12 @@
+import pytest
+from Benchmark import naive_ease
+import Easing
+
+
+@pytest.mark.parametrize('easing', sorted(Easing.functions))
+def test_independent_easings_agree_with_the_library(easing):
+    progress = [i / 1000 for i in range(1001)]
+
+    eased = Easing.ease_many(easing, progress)
+
+    assert list(eased) == pytest.approx([naive_ease(easing, t) for t in progress], abs=1e-9)
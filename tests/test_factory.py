@@ -0,0 +1,17 @@
+from Benchmark import synthetic_storyboard
+
+
+def test_duration_without_a_start_begins_at_zero(tmp_path):
+    storyboard, _ = synthetic_storyboard(str(tmp_path), sprites=0)
+    factory = storyboard.new_command_factory()
+    factory.type('F').start(0).duration('1/2')
+    factory.tupS = (0,)
+    explicit = factory.build()
+
+    factory.reset()
+    factory.type('F').duration('1/2')
+    factory.tupS = (0,)
+    command = factory.build()
+
+    assert command.start_time == 0
+    assert command.end_time == explicit.end_time > 0
@@ -0,0 +1,59 @@
+from Command import F
+from Mapset import Mapset
+
+difficulty = '''osu file format v14
+
+[General]
+AudioFilename: audio.mp3
+
+[Metadata]
+Title:Title
+Artist:Art
+Creator:Okorin
+Version:{version}
+
+[Events]
+//Background and Video events
+0,0,"bg.jpg",0,0
+//Storyboard Layer 0 (Background)
+Sprite,Background,Centre,"sb/{version}.png",320,240
+ F,0,0,100,0,1
+//Storyboard Sound Samples
+Sample,1000,0,"hit.wav",70
+
+[TimingPoints]
+1000,500,4,2,0,60,1,0
+
+[HitObjects]
+256,192,1000,1,0,0:0:0:0:
+'''
+
+
+def write_mapset(folder):
+    for version in ('Hard', 'Insane'):
+        (folder / 'Art - Title (Okorin) [{}].osu'.format(version)).write_text(difficulty.format(version=version))
+
+
+def test_write_replaces_sprites_but_keeps_samples(tmp_path):
+    write_mapset(tmp_path)
+    mapset = Mapset(str(tmp_path), seed=1)
+    mapset.storyboard('Hard').new_sprite('sb/new.png').append(F(0, 0, 500, 0, 1))
+
+    mapset.write(processes=1)
+
+    text = (tmp_path / 'Art - Title (Okorin) [Hard].osu').read_text()
+    assert 'Sample,1000,0,"hit.wav",70' in text
+    assert '"sb/new.png"' in text
+    assert '"sb/Hard.png"' not in text
+    assert text.index('"sb/new.png"') < text.index('//Storyboard Sound Samples')
+
+
+def test_write_leaves_difficulties_without_sprites_alone(tmp_path):
+    write_mapset(tmp_path)
+    mapset = Mapset(str(tmp_path), seed=1)
+    mapset.storyboard('Hard').new_sprite('sb/new.png').append(F(0, 0, 500, 0, 1))
+
+    mapset.write(processes=1)
+
+    insane = (tmp_path / 'Art - Title (Okorin) [Insane].osu').read_text()
+    assert insane == difficulty.format(version='Insane')
@@ -0,0 +1,101 @@
+from random import Random
+import pytest
+from Command import Command, F, L, M, S, MX
+from Object import Sprite
+
+
+def quadratic(commands):
+    # the filter SBObj.render used before the sweep: hidden if a same-type command starts strictly before and ends
+    # strictly after
+    return [command for command in commands
+            if not any(other.t == command.t and other.start_time < command.start_time and
+                       other.end_time > command.end_time and other is not command for other in commands)]
+
+
+def random_commands(rng, count):
+    # few distinct times, so equal starts and ends come up all the time
+    commands = list()
+    for _ in range(count):
+        start = rng.randrange(0, 20) * 50
+        end = start + rng.randrange(0, 6) * 50
+        kind = rng.choice((F, M, S, MX))
+        if kind is M:
+            commands.append(M(0, start, end, rng.randrange(3), 0, rng.randrange(3), 0))
+        else:
+            commands.append(kind(0, start, end, rng.random(), rng.random()))
+    return sorted(dict.fromkeys(commands))
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_visible_matches_quadratic_filter(seed):
+    rng = Random(seed)
+    commands = random_commands(rng, rng.randrange(0, 60))
+
+    assert Command.visible(commands) == quadratic(commands)
+    assert [command.render() for command in Command.visible(commands)] == \
+        [command.render() for command in quadratic(commands)]
+
+
+def test_ties_on_start_and_end_stay_visible():
+    commands = sorted([F(0, 0, 100, 0, 1), F(0, 0, 50, 1, 0), F(0, 50, 100, 0, 1), F(0, 10, 90, 1, 1)])
+
+    assert Command.visible(commands) == quadratic(commands)
+    assert len(Command.visible(commands)) == 3
+
+
+def random_loop(rng):
+    loop = L(rng.randrange(0, 20) * 50, rng.randrange(0, 4))
+    for _ in range(rng.randrange(0, 4)):
+        start = rng.randrange(0, 4) * 25
+        loop.add(rng.choice((F, S))(0, start, start + rng.randrange(0, 4) * 25, rng.random(), rng.random()))
+    return loop
+
+
+def checked_against_every_loop(commands):
+    # the loop filter before the index: every command against every loop of the object
+    plain = quadratic([command for command in commands if command.t != 'L'])
+    visible = [command for command in commands if command.t == 'L' or command in plain]
+    loops = [command for command in visible if command.t == 'L']
+    return [command for command in visible if command.t == 'L' or
+            not any(loop.contains(command.t, command.start_time, command.end_time) for loop in loops)]
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_visible_with_loops_matches_checking_every_loop(seed):
+    rng = Random(seed)
+    commands = random_commands(rng, rng.randrange(0, 40)) + [random_loop(rng) for _ in range(rng.randrange(1, 6))]
+    commands = sorted(dict.fromkeys(commands))
+
+    assert [command.render() for command in Command.visible(commands)] == \
+        [command.render() for command in checked_against_every_loop(commands)]
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_table_rendering_with_loops_matches_objects(seed):
+    rng = Random(seed)
+    commands = random_commands(rng, rng.randrange(0, 40)) + [random_loop(rng) for _ in range(rng.randrange(1, 6))]
+    plain = Sprite('sb/dot.png')
+    table = Sprite('sb/dot.png').use_table()
+    for command in commands:
+        plain.append(command)
+        table.append(command)
+
+    assert table.render() == plain.render()
+
+
+def test_loops_are_only_checked_near_each_command(monkeypatch):
+    calls = list()
+    contains = L.contains
+    monkeypatch.setattr(L, 'contains', lambda loop, *span: calls.append(span) or contains(loop, *span))
+
+    count = 2000
+    sprite = Sprite('sb/dot.png')
+    for i in range(count):
+        loop = L(i * 1000, 2)
+        loop.add(M(0, 0, 100, 0, 0, 10, 10))
+        sprite.append(loop)
+        sprite.append(M(0, i * 1000 + 300, i * 1000 + 400, 0, 0, 5, 5))
+    lines = sprite.render().split('\n')
+
+    assert len(lines) == 1 + count * 2 + count + 2
+    assert len(calls) <= 2 * count
@@ -0,0 +1,39 @@
+import pytest
+from Command import F, M
+from Object import Sprite
+from Optimizer import Optimizer
+from State import StateTable
+
+
+def sprite_with(*commands):
+    sprite = Sprite('sb/dot.png', 'Foreground', 'Centre', 320, 240)
+    for command in commands:
+        sprite.append(command)
+    return sprite
+
+
+def states(sprite, times):
+    table = StateTable.evaluate([sprite], times)
+    return [table.state(0, i) for i in range(len(times))]
+
+
+def test_merge_keeps_shorter_commands_of_its_type_visible():
+    sprite = sprite_with(F(0, 0, 100, 1, 1), F(0, 100, 200, 1, 1), F(0, 100, 150, 0, 0))
+    times = list(range(0, 220, 10))
+    before = states(sprite, times)
+
+    Optimizer().optimize(sprite)
+
+    assert states(sprite, times) == before
+    assert StateTable.evaluate([sprite], [120]).value('opacity', 0, 0) == 0.0
+
+
+def test_merge_of_continuing_commands():
+    sprite = sprite_with(M(0, 0, 100, 0, 0, 100, 100), M(0, 100, 200, 100, 100, 200, 200))
+    times = list(range(0, 220, 10))
+    before = states(sprite, times)
+
+    report = Optimizer().optimize(sprite)
+
+    assert [pytest.approx(state) for state in states(sprite, times)] == before
+    assert report['merged'] == 1
@@ -0,0 +1,65 @@
+from Parser import OsbParser
+
+
+def load(tmp_path, text):
+    path = tmp_path / 'test.osb'
+    path.write_text(text)
+    parser = OsbParser(str(path))
+    return parser, parser.load()
+
+
+def test_trigger_children_stay_out_of_the_loop_before_it(tmp_path):
+    parser, objects = load(tmp_path, '[Events]\n'
+                                     'Sprite,Foreground,Centre,"sb/dot.png",320,240\n'
+                                     ' L,0,2\n'
+                                     '  F,0,0,100,0,1\n'
+                                     ' T,HitSound,0,1000\n'
+                                     '  F,0,0,50,1,0\n')
+
+    loop, = objects[0].commands
+    assert loop.t == 'L'
+    assert [(command.start_time, command.end_time) for command in loop.commands] == [(0, 100)]
+    assert parser.skipped == 2
+
+
+def test_children_of_a_new_object_never_join_an_earlier_loop(tmp_path):
+    _, objects = load(tmp_path, '[Events]\n'
+                                'Sprite,Foreground,Centre,"sb/a.png",320,240\n'
+                                ' L,0,2\n'
+                                '  F,0,0,100,0,1\n'
+                                'Sprite,Foreground,Centre,"sb/b.png",320,240\n'
+                                '  F,0,0,50,1,0\n')
+
+    assert len(objects[0].commands[0].commands) == 1
+    assert objects[1].commands == []
+
+
+def test_plain_lines_parse_the_same_as_the_general_rows(tmp_path, monkeypatch):
+    text = ('[Events]\n'
+            'Sprite,Foreground,Centre,"sb/a.png",320,240\n'
+            ' F,0,0,100,0,1.5\n'
+            ' S,1,0,100,-1,2\n'
+            ' M,2,100,200,320.5,240,100,100\n'
+            ' MX,0,100,300,10,20\n'
+            ' F,0,100,100,0.5,0.25\n'
+            ' V,0,200,400,1,2,0.5,0.5\n'
+            ' C,0,300,400,300,128,0,255,255,-4\n'
+            ' R,0,400,500,0,3.14\n'
+            ' F,0,500,,1\n'
+            ' F,0,600,500,1,0\n'
+            ' L,600,2\n'
+            '  M,0,0,100,0,0,10,10\n'
+            '  F,0,0,100,2,0\n')
+    path = tmp_path / 'test.osb'
+    path.write_text(text)
+
+    rows = list()
+    parse_rows = OsbParser.parse_rows
+    monkeypatch.setattr(OsbParser, 'parse_rows', lambda fields: rows.append(fields) or parse_rows(fields))
+    fast = [[sbobj.render() for sbobj in OsbParser(str(path)).load(table=table)] for table in (False, True)]
+    # only the lines with something out of the ordinary went the long way
+    assert len(rows) == 2 * 4
+    monkeypatch.setattr(OsbParser, 'plain', dict())
+    general = [[sbobj.render() for sbobj in OsbParser(str(path)).load(table=table)] for table in (False, True)]
+
+    assert fast == general
@@ -0,0 +1,23 @@
+from Benchmark import synthetic_storyboard
+from Profiler import Profiler
+
+
+def build_fade(factory, start):
+    factory.type('F').start(start).end(start + 100)
+    factory.easing(0)
+    factory.tupS = (0,)
+    factory.tupE = (1,)
+    return factory.build()
+
+
+def test_builds_after_a_reset_are_still_profiled(tmp_path):
+    storyboard, _ = synthetic_storyboard(str(tmp_path), sprites=0)
+    storyboard.profiler = Profiler()
+    factory = storyboard.new_command_factory()
+
+    build_fade(factory, 0)
+    factory.reset()
+    build_fade(factory, 200)
+
+    assert factory.profiler is storyboard.profiler
+    assert [build['count'] for build in storyboard.profiler.report()['builds']] == [2]